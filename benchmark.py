@@ -0,0 +1,233 @@
+from xlsxfile import XLSXFile
+from datamanipulator import DataManipulator
+from openpyxl import Workbook
+import numpy as np
+import openpyxl, os, io, gc, json, glob, time, platform, argparse, tempfile, tracemalloc, contextlib, subprocess
+
+
+# Create the parser
+my_parser = argparse.ArgumentParser(prog="GPC Normaliser Benchmark",
+                                    usage="%(prog)s --output [path] --points [N] --channels [N] --files [N] --ranges [N] ...",
+                                    description='Per-stage benchmark of the GDB GPC Normalisation Tool: parse, extract, normalise and export, plus the memory held per loaded file.')
+
+# Add the arguments
+my_parser.add_argument("-o", "--output", action="store", type=str, default="benchmark_results.json", required=False, help="usage: -o [path] -> (defaults to benchmark_results.json) JSON file the results are written to.")
+my_parser.add_argument("-p", "--points", action="store", type=int, nargs="+", default=[2000], required=False, help="usage: -p [N...] -> (defaults to 2000) number of time points of every synthetic file, one data set per value.")
+my_parser.add_argument("-c", "--channels", action="store", type=int, default=3, required=False, help="usage: -c [N] -> (defaults to 3) number of detector channels of the synthetic files.")
+my_parser.add_argument("-f", "--files", action="store", type=int, default=15, required=False, help="usage: -f [N] -> (defaults to 15) number of synthetic files per data set.")
+my_parser.add_argument("-r", "--ranges", action="store", type=int, default=4, required=False, help="usage: -r [N] -> (defaults to 4) number of time ranges normalised in every data set.")
+my_parser.add_argument("--repeat", action="store", type=int, default=3, required=False, help="usage: --repeat [N] -> (defaults to 3) runs per stage, the fastest one is reported.")
+my_parser.add_argument("--no-examples", action="store_true", default=False, required=False, help="usage: --no-examples -> skip the bundled examples/GDB KS0282 t*.xlsx series.")
+my_parser.add_argument("--no-synthetic", action="store_true", default=False, required=False, help="usage: --no-synthetic -> skip the generated data sets.")
+
+
+CWD = os.path.dirname(os.path.abspath(__file__))
+EXAMPLES = os.path.join(CWD, "examples", "GDB KS0282 t*.xlsx")
+
+
+
+
+##################################### Synthetic data:
+
+
+### Writes a workbook with the same "Raw Data" layout as the instrument exports: a "Channel ID" block followed by an "RT (mins)" block.
+def make_synthetic_workbook(path: str, points: int, channels: int, seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    time = np.arange(points, dtype=np.float64) / 60.0
+    run_length = time[-1]
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title="Raw Data")
+    ws.append(["Sample Collection Parameters"])
+    ws.append(["Number of channels", channels])
+    ws.append(["Number of data points", points])
+    ws.append([])
+    ws.append(["Sample Channel Information"])
+    ws.append(["Channel ID", "Detector type", "Detector name", "Detector units", "Channel Information"])
+    for channel in range(0, channels):
+        ws.append([channel + 1, f"Detector {channel + 1}", f"Synthetic signal {channel + 1}", "mV", ""])
+    ws.append([])
+    ws.append(["Raw Data"])
+    ws.append(["RT (mins)"] + [f"Response Trace {channel + 1}" for channel in range(0, channels)])
+
+    traces = np.empty((channels, points), dtype=np.float64)
+    for channel in range(0, channels):
+        centre = run_length * rng.uniform(0.3, 0.7)
+        width = run_length * rng.uniform(0.02, 0.08)
+        traces[channel] = rng.uniform(1, 100) * np.exp(-0.5 * ((time - centre) / width) ** 2) + rng.uniform(-1, 1) + rng.normal(0, 0.05, points)
+
+    for i in range(0, points):
+        ws.append([float(time[i])] + traces[:, i].tolist())
+
+    wb.save(filename=path)
+
+
+def make_synthetic_set(directory: str, files: int, points: int, channels: int) -> list:
+    paths = []
+    for i in range(0, files):
+        path = os.path.join(directory, f"synthetic p{points} c{channels} t{i}.xlsx")
+        make_synthetic_workbook(path=path, points=points, channels=channels, seed=i)
+        paths.append(path)
+    return paths
+
+
+### Evenly spaced, overlapping windows inside the common time axis of the files.
+def make_ranges(files: list, number_of_ranges: int) -> list:
+    first = max(float(file.data["time"][0]) for file in files)
+    last = min(float(file.data["time"][-1]) for file in files)
+    span = last - first
+    starts = np.linspace(first + 0.1 * span, first + 0.4 * span, number_of_ranges)
+    return [(round(float(start), 4), round(float(start + 0.5 * span), 4)) for start in starts]
+
+
+
+
+
+##################################### Measurements:
+
+
+### Runs a stage repeat times for the fastest wall time, then once more under tracemalloc for the peak memory.
+def measure(stage, repeat: int) -> dict:
+    seconds = []
+    for _ in range(0, repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            stage()
+            seconds.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            stage()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {"seconds": min(seconds), "peak_mb": peak / 1e6}
+
+
+### Memory still held per loaded file once parsing is over: the set is loaded under tracemalloc, garbage is collected and the
+### traced memory left is divided by the number of files. The overhead is what is held beyond the time axis and traces.
+def measure_retained(paths: list) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        with contextlib.redirect_stdout(io.StringIO()):
+            files = [XLSXFile(path=path) for path in paths]
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - baseline
+    finally:
+        tracemalloc.stop()
+
+    data = sum(file.data["time"].nbytes + file.data["traces"].nbytes for file in files)
+    return {
+        "retained_kb_per_file": retained / len(files) / 1e3,
+        "data_kb_per_file": data / len(files) / 1e3,
+        "overhead_kb_per_file": (retained - data) / len(files) / 1e3,
+    }
+
+
+def benchmark_data_set(name: str, paths: list, number_of_ranges: int, repeat: int) -> dict:
+    with contextlib.redirect_stdout(io.StringIO()):
+        files = [XLSXFile(path=path) for path in paths]
+    ranges = make_ranges(files=files, number_of_ranges=number_of_ranges)
+    raw_points = sum(file.data["traces"].size for file in files)
+    manipulator = DataManipulator()
+    stages = {}
+
+    def parse():
+        for path in paths:
+            XLSXFile(path=path)
+
+    def extract():
+        for file in files:
+            manipulator.query_windows(file=file, ranges=ranges)
+
+    def height_normalise():
+        for file in files:
+            file.results = []
+        for file in files:
+            manipulator.height_normalise_ranges(file=file, ranges=ranges)
+
+    def kinetic_normalise():
+        nonlocal manipulator
+        manipulator = DataManipulator()
+        manipulator.number_of_files = len(files)
+        manipulator.kinetic_normalise(files=files, ranges=ranges)
+
+    with tempfile.TemporaryDirectory() as save_directory:
+        def save_height():
+            manipulator.save_height_data_to_file(save_directory=save_directory, files=files)
+
+        def save_kinetics():
+            manipulator.save_kinetics_data_to_file(save_directory=save_directory)
+
+        window_points = 0
+        for file in files:
+            windows = manipulator.query_windows(file=file, ranges=ranges)
+            window_points += int(np.sum(windows["stops"] - windows["starts"] + 1)) * file.data["traces"].shape[0]
+
+        for stage, points in ((parse, raw_points), (extract, window_points), (height_normalise, window_points), (kinetic_normalise, window_points), (save_height, window_points), (save_kinetics, window_points)):
+            result = measure(stage=stage, repeat=repeat)
+            result["points"] = points
+            result["points_per_second"] = points / result["seconds"] if result["seconds"] > 0 else None
+            stages[stage.__name__] = result
+            print(f"{name:<40} {stage.__name__:<20} {result['seconds']:>10.4f} s {result['peak_mb']:>10.2f} MB")
+
+    retained = measure_retained(paths=paths)
+    print(f"{name:<40} {'retained per file':<20} {retained['retained_kb_per_file']:>10.1f} kB, overhead {retained['overhead_kb_per_file']:.1f} kB over {retained['data_kb_per_file']:.1f} kB of data")
+
+    return {
+        "name": name,
+        "files": len(files),
+        "channels": max(len(file.data["channels"]) for file in files),
+        "points": max(len(file.data["time"]) for file in files),
+        "ranges": ranges,
+        "stages": stages,
+        "retained": retained,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=CWD, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+
+def main(args):
+    report = {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "openpyxl": openpyxl.__version__,
+        "repeat": args.repeat,
+        "data_sets": [],
+    }
+
+    if not args.no_examples:
+        paths = sorted(glob.glob(EXAMPLES))
+        if len(paths) > 0:
+            report["data_sets"].append(benchmark_data_set(name="examples", paths=paths, number_of_ranges=args.ranges, repeat=args.repeat))
+
+    if not args.no_synthetic:
+        with tempfile.TemporaryDirectory() as directory:
+            for points in args.points:
+                paths = make_synthetic_set(directory=directory, files=args.files, points=points, channels=args.channels)
+                name = f"synthetic {args.files}f x {args.channels}c x {points}p"
+                report["data_sets"].append(benchmark_data_set(name=name, paths=paths, number_of_ranges=args.ranges, repeat=args.repeat))
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved benchmark results to: {args.output}")
+
+
+
+
+if __name__ == "__main__":
+    ARGS = my_parser.parse_args()
+    main(args=ARGS)
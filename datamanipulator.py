@@ -1,7 +1,13 @@
 from xlsxfile import XLSXFile
+from kineticresults import KineticResults, KineticAccumulator
+from windowindex import WindowIndex
+from tracestore import TraceStore
+from decimation import DECIMATION_METHODS, decimate
+from profiler import profiled
 from openpyxl import Workbook
 from openpyxl.chart import Reference, LineChart
 from openpyxl.utils import get_column_letter
+import numpy as np
 import os
 
 
@@ -10,17 +16,15 @@ class DataManipulator():
     def __init__(self) -> None:
         self.kinetic_keys = []
         self.detector_keys = []
-        self.kinetic_results = []
-        self.files_data = []
-        self.max_areas = {}
-        self.max_heights = {}
+        self.kinetic_results = KineticResults()
+        self.kinetics = KineticAccumulator()
         self.number_of_files = -1
-
-
-    def clear_all_kinetics(self) -> None:
-        self.files_data = []
-        self.max_areas = {}
-        self.max_heights = {}
+        self.charts = True
+        self.integration = "trapezoid"
+        self.trace_store = None
+        self.window_index_ranges = 64
+        self.chart_points = None
+        self.decimation = "lttb"
 
 
 ##################################### ARGS INPUT CHECKS:
@@ -34,6 +38,22 @@ class DataManipulator():
             exit(f"Incorrect mode has been provided: {mode}. Please adjust you input to:\n\nkineic\nheight\nboth")
 
 
+    def check_integration(self, arg: str):
+        method = arg.lower().strip()
+        if method == "trapezoid" or method == "simpson":
+            return method
+        else:
+            exit(f"Incorrect integration method has been provided: {method}. Please adjust you input to:\n\ntrapezoid\nsimpson")
+
+
+    def check_decimation(self, arg: str):
+        method = arg.lower().strip()
+        if method in DECIMATION_METHODS:
+            return method
+        else:
+            exit(f"Incorrect decimation method has been provided: {method}. Please adjust you input to:\n\n" + "\n".join(DECIMATION_METHODS))
+
+
     def check_ranges_input(self, args, combination: bool) -> list:
         if combination:
             input_str = " ".join(args)
@@ -95,101 +115,101 @@ class DataManipulator():
 
 ##################################### DATA EXTRACTION METHODS:
 
-    def extract_data(self, file: XLSXFile, start: float, stop: float) -> dict:
-        time = file.data["time"]
-        extracted_time = self.extract_time_data(data=time, start=start, stop=stop)
-        indexes = self.find_start_and_stop_indexes(data=time, start_value=extracted_time[0], stop_value=extracted_time[len(extracted_time) - 1])
-
-        output = {
-            "start_time": start,
-            "stop_time": stop,
-            "time": extracted_time,
-        }
-
-        for d in file.data["channels"]:
-            key = d["type"]
-            detector_data = file.data["data_points"][key]
-            extracted_data = self.extract_from_data_on_indexes(data=detector_data, start_index=indexes[0], stop_index=indexes[1])
-            output[key] = extracted_data
-        
-        return output
-
-
-    ### Data extraction method.
-    def extract_time_data(self, data: list, start: float, stop: float) -> list:
-        return [point for point in data if point >= start if point <= stop]
-
-
-    ### Method returs extracted data from a list based on specified indexes.
-    def extract_from_data_on_indexes(self, data: list, start_index: int, stop_index: int) -> list:
-        if stop_index < start_index or len(data) - 1 < stop_index or start_index < 0:
+    ### Method returs extracted data (a view, not a copy) from an array along the time axis based on specified indexes.
+    def extract_from_data_on_indexes(self, data: np.ndarray, start_index: int, stop_index: int) -> np.ndarray:
+        if stop_index < start_index or data.shape[-1] - 1 < stop_index or start_index < 0:
             print(f"Fundamentally wrong indexes were passed to extract data, are you sure {start_index} and {stop_index} are correct?")
             exit()
 
-        return data[start_index : stop_index + 1]
+        return data[..., start_index : stop_index + 1]
     
 
-    ### Finds start and stop indexes of the extracted data using extract_time_data method.
-    def find_start_and_stop_indexes(self, data: list, start_value: float, stop_value: float) -> tuple:
-        start_index = -1
-        stop_index = -1
-        index = 0
-
-        for point in data:
-            if point == start_value:
-                start_index = index
-            if point == stop_value:
-                stop_index = index
-                break
-            
-            index += 1
-        
-        return (start_index, stop_index)
+    ### Start and stop indexes (inclusive) of every (start, stop) time range, found by binary search on the sorted time axis.
+    def find_window_indexes(self, time: np.ndarray, ranges: list) -> tuple:
+        starts = np.searchsorted(time, [float(start) for start, stop in ranges], side="left")
+        stops = np.searchsorted(time, [float(stop) for start, stop in ranges], side="right") - 1
+        return (starts.astype(np.int64), stops.astype(np.int64))
 
 
+    ### All ranges of a file at once: start/stop indexes plus (channels x windows) minima, maxima and min-shifted areas.
+    ### Each window is reduced on its own slice. Only with at least window_index_ranges ranges a WindowIndex is built, its sparse
+    ### tables cost more to build than a few slices do to scan. The index is dropped once the windows are computed.
+    @profiled("query_windows", points=lambda call, result: int(np.sum(result["stops"] - result["starts"] + 1)) * call["file"].data["traces"].shape[0])
+    def query_windows(self, file: XLSXFile, ranges: list) -> dict:
+        time = file.data["time"]
+        traces = file.data["traces"]
+        starts, stops = self.find_window_indexes(time=time, ranges=ranges)
+
+        for w, (start, stop) in enumerate(ranges):
+            if stops[w] < starts[w]:
+                exit(f"No data points were found between {start} and {stop}. Double check your time ranges.")
+
+        index = None
+        if len(ranges) >= self.window_index_ranges:
+            index = WindowIndex(time=time, traces=traces)
+            mins = index.minima(starts=starts, stops=stops)
+            maxs = index.maxima(starts=starts, stops=stops)
+        else:
+            mins = np.empty((traces.shape[0], len(ranges)), dtype=np.float64)
+            maxs = np.empty(mins.shape, dtype=np.float64)
+            for w in range(0, len(ranges)):
+                window = traces[:, starts[w] : stops[w] + 1]
+                mins[:, w] = np.min(window, axis=1)
+                maxs[:, w] = np.max(window, axis=1)
+
+        return {
+            "starts": starts,
+            "stops": stops,
+            "mins": mins,
+            "maxs": maxs,
+            "areas": self.compute_window_areas(time=time, traces=traces, starts=starts, stops=stops, mins=mins, index=index),
+        }
 
 
+    ### Height and kinetic normalisation of one file share a single query of its windows.
+    def normalise_file(self, file: XLSXFile, ranges: list, mode: str):
+        windows = self.query_windows(file=file, ranges=ranges)
+        if mode != "kinetic":
+            self.height_normalise_ranges(file=file, ranges=ranges, windows=windows)
+        if mode != "height":
+            self.add_file_to_kinetics(file=file, ranges=ranges, windows=windows)
 
-##################################### Height normalisation:
 
 
-    def height_normalise(self, file: XLSXFile, start: float, stop: float):
-        extracted_raw = self.extract_data(file=file, start=start, stop=stop)
-        for d in file.data["channels"]:
-            key = d["type"]
-            h_normalised_data = self.do_height_normalisation(data=extracted_raw[key])
-            result = {
-                "mode": "height",
-                "detector_type": key,
-                "start_time": extracted_raw["start_time"],
-                "stop_time": extracted_raw["stop_time"],
-                "time": extracted_raw["time"],
-                "height_normalised": h_normalised_data
-            }
-            file.results.append(result)
-
-
-    def do_height_normalisation(self, data: list) -> list:
-        min_shifted = self.shift_minimum_to_zero(data=data)
-        return self.height_normalise_set(data=min_shifted)
-    
 
-    def height_normalise_set(self, data: list) -> list:
-        max = self.find_max(data=data)
-        return [point / max for point in data] # by dividing all points by max value of the set, the result values will be between 0 and 1 for min-shifted data.
 
+##################################### Height normalisation:
 
-    def shift_minimum_to_zero(self, data: list) -> list:
-        min = self.find_min(data=data)
-        return [point - min for point in data] # by substarcting minimum value of the set from all points, the actual minimum will shift to 0.
 
+    ### Height normalises every range of a file in one go: window minima and maxima come from query_windows (or the windows
+    ### already queried for the file), so each result is (window - min) / (max - min) without another pass over the window.
+    @profiled("height_normalise", points=lambda call, result: sum(r["height_normalised"].size for r in call["file"].results[-len(call["file"].data["channels"]) * len(call["ranges"]):]))
+    def height_normalise_ranges(self, file: XLSXFile, ranges: list, windows: dict = None):
+        if windows == None:
+            windows = self.query_windows(file=file, ranges=ranges)
 
-    def find_min(self, data: list) -> float:
-        return min(data)
+        for w, (start, stop) in enumerate(ranges):
+            start_index = int(windows["starts"][w])
+            stop_index = int(windows["stops"][w])
+            time = self.extract_from_data_on_indexes(data=file.data["time"], start_index=start_index, stop_index=stop_index)
+            traces = self.extract_from_data_on_indexes(data=file.data["traces"], start_index=start_index, stop_index=stop_index)
+            mins = windows["mins"][:, w, np.newaxis]
+            h_normalised_traces = (traces - mins) / (windows["maxs"][:, w, np.newaxis] - mins)
 
+            if self.trace_store != None:
+                h_normalised_traces = self.trace_store.put(key=self.trace_store.make_key(file_name=os.path.basename(file.path), channel=None, range_key=f"{start} - {stop}", kind="height_normalised"), array=h_normalised_traces)
 
-    def find_max(self, data: list) -> float:
-        return max(data)
+            for i, d in enumerate(file.data["channels"]):
+                key = d["type"]
+                result = {
+                    "mode": "height",
+                    "detector_type": key,
+                    "start_time": start,
+                    "stop_time": stop,
+                    "time": time,
+                    "height_normalised": h_normalised_traces[i]
+                }
+                file.results.append(result)
 
 
 
@@ -198,259 +218,361 @@ class DataManipulator():
 ##################################### Kinetic normalisation:
 
 
-    def kinetic_normalise(self, files: list, start: float, stop: float):
-        kinetic_key = f"{start} - {stop}"
-        self.kinetic_keys.append(kinetic_key)
-        time = []
-
+    ### Every file's min-shifted trace is scaled to the largest area of its channel and then divided by the largest resulting height.
+    ### Both steps together reduce to: min_shifted / (area * max(height / area)), where the max is taken over all files of the channel.
+    ### All ranges are processed in one call.
+    @profiled("kinetic_normalise", points=lambda call, result: sum(block["kinetics_normalised"].size for block in call["self"].kinetic_results.blocks.values() if block["time_key"] in [f"{start} - {stop}" for start, stop in call["ranges"]]))
+    def kinetic_normalise(self, files: list, ranges: list):
         for file in files:
-            dT = file.data["time"][1] - file.data["time"][0]
-            extracted_raw = self.extract_data(file=file, start=start, stop=stop)
-            time = extracted_raw["time"]
-            for d in file.data["channels"]:
+            self.add_file_to_kinetics(file=file, ranges=ranges)
+        self.finish_kinetics()
+
+
+    ### Adds one file to the running kinetic normalisation, only its min-shifted windows divided by their areas are kept.
+    ### Each range has one retention time grid, the window of the first file added to it. The windows of all later files are
+    ### resampled onto that grid, so every (detector, range) block is a dense files x points matrix on a single time column.
+    @profiled("add_file_to_kinetics", points=lambda call, result: call["file"].data["traces"].size)
+    def add_file_to_kinetics(self, file: XLSXFile, ranges: list, windows: dict = None):
+        file_name = os.path.basename(file.path)
+        if windows == None:
+            windows = self.query_windows(file=file, ranges=ranges)
+
+        for w, (start, stop) in enumerate(ranges):
+            kinetic_key = f"{start} - {stop}"
+            if kinetic_key not in self.kinetic_keys:
+                self.kinetic_keys.append(kinetic_key)
+
+            start_index = int(windows["starts"][w])
+            stop_index = int(windows["stops"][w])
+            time = self.extract_from_data_on_indexes(data=file.data["time"], start_index=start_index, stop_index=stop_index)
+            traces = self.extract_from_data_on_indexes(data=file.data["traces"], start_index=start_index, stop_index=stop_index)
+
+            mins = windows["mins"][:, w]
+            maxs = windows["maxs"][:, w]
+            areas = windows["areas"][:, w]
+
+            grid = self.kinetics.grid(range_key=kinetic_key)
+            if grid is None:
+                grid = np.array(time)
+            elif len(grid) != len(time) or not np.array_equal(grid, time):
+                traces, mins, maxs, areas = self.resample_window(file=file, grid=grid, start=start, stop=stop)
+            time = grid
+            unit_area_traces = (traces - mins[:, np.newaxis]) / areas[:, np.newaxis]
+            ratios = (maxs - mins) / areas
+
+            for i, d in enumerate(file.data["channels"]):
                 key = d["type"]
                 if key not in self.detector_keys:
                     self.detector_keys.append(key)
-                min_shifted = self.shift_minimum_to_zero(data=extracted_raw[key])
-                area = self.compute_area(data=min_shifted, dT=dT)
+                self.kinetics.add(detector_key=key, range_key=kinetic_key, start=start, stop=stop, time=time, file_name=file_name, unit_area_trace=unit_area_traces[i], ratio=ratios[i])
+
+
+    ### A window resampled onto the grid of its range is normalised on the grid: minima, maxima and areas are taken from the
+    ### resampled traces, over the grid points inside the file's time axis (the others are NaN), so no value ends up below zero.
+    def resample_window(self, file: XLSXFile, grid: np.ndarray, start: float, stop: float) -> tuple:
+        time = file.data["time"]
+        traces = self.resample(time=time, traces=file.data["traces"], grid=grid)
+        covered = np.nonzero((grid >= time[0]) & (grid <= time[-1]))[0]
+        if len(covered) == 0:
+            exit(f"No data points of {os.path.basename(file.path)} are on the time grid between {start} and {stop}. Double check your time ranges.")
+
+        window = traces[:, covered[0] : covered[-1] + 1]
+        mins = np.min(window, axis=1)
+        maxs = np.max(window, axis=1)
+        areas = self.compute_area(data=window - mins[:, np.newaxis], time=grid[covered[0] : covered[-1] + 1], method=self.integration)
+        return (traces, mins, maxs, areas)
+
+
+    ### Linear interpolation of (channels x points) traces at the grid times, vectorised over channels. Grid times that match a
+    ### sample take its value exactly, grid times outside the time axis are NaN.
+    def resample(self, time: np.ndarray, traces: np.ndarray, grid: np.ndarray) -> np.ndarray:
+        right = np.clip(np.searchsorted(time, grid, side="right"), 1, len(time) - 1)
+        left = right - 1
+        spacing = time[right] - time[left]
+        weights = np.divide(grid - time[left], spacing, out=np.zeros(len(grid)), where=spacing > 0)
+
+        resampled = traces[:, left] * (1 - weights) + traces[:, right] * weights
+        exact = weights <= 0
+        resampled[:, exact] = traces[:, left[exact]]
+        exact = weights >= 1
+        resampled[:, exact] = traces[:, right[exact]]
+        resampled[:, (grid < time[0]) | (grid > time[-1])] = np.nan
+        return resampled
 
-                try:
-                    previous_max_area = self.max_areas[key]
-                    if previous_max_area < area:
-                        self.max_areas[key] = area
-                except:
-                    self.max_areas[key] = area
-
-                chunk_data = {
-                    "file_name": os.path.basename(file.path),
-                    "file_id": str(file.id),
-                    "channel": key,
-                    "min_shifted": min_shifted,
-                    "area": area,
-                    "area_normalised": [],
-                    "height_normalised": [],
-                }
-                
-                self.files_data.append(chunk_data)
-
-        for data in self.files_data:
-            key = data["channel"]
-            coeff = self.max_areas[key] / data["area"]
-            data["area_normalised"] = [point * coeff for point in data["min_shifted"]]
-
-        for data in self.files_data:
-            key = data["channel"]
-            height = self.find_max(data=data["area_normalised"])
-
-            try:
-                previous_max_height = self.max_heights[key]
-                if previous_max_height < height:
-                    self.max_heights[key] = height
-            except:
-                self.max_heights[key] = height
-
-        for data in self.files_data:
-            key = data["channel"]
-            max_height = self.max_heights[key]
-            data["height_normalised"] = [point / max_height for point in data["area_normalised"]]
-
-            result = {
-                "file_name": data["file_name"],
-                "mode": "kinetic",
-                "time_key": kinetic_key,
-                "detector_type": key,
-                "start_time": start,
-                "stop_time": stop,
-                "time": time,
-                "kinetics_normalised": data["height_normalised"]
-            }
-
-            self.kinetic_results.append(result)
-
-        self.clear_all_kinetics()
+
+    def finish_kinetics(self):
+        self.kinetics.write_results(results=self.kinetic_results)
+
+
+    ### Restores a previous kinetic normalisation, so files added afterwards only contribute their own windows.
+    def load_kinetics_state(self, path: str, ranges: list) -> list:
+        self.kinetics = KineticAccumulator(store=self.trace_store)
+        self.kinetics.load(path=path)
+
+        state_ranges = [(time_range["start"], time_range["stop"]) for time_range in self.kinetics.ranges.values()]
+        if sorted(state_ranges) != sorted((float(start), float(stop)) for start, stop in ranges):
+            exit(f"The state file at {path} was made with different time ranges: {state_ranges}. Use the same ranges or a new state file.")
+
+        for range_key in self.kinetics.ranges:
+            if range_key not in self.kinetic_keys:
+                self.kinetic_keys.append(range_key)
+        for detector_key, range_key in self.kinetics.entries:
+            if detector_key not in self.detector_keys:
+                self.detector_keys.append(detector_key)
+
+        return self.kinetics.file_names()
+
+
+    def save_kinetics_state(self, path: str):
+        self.kinetics.save(path=path)
+
+
+    ### Intermediate traces and results of everything normalised from here on are kept in the store.
+    def use_trace_store(self, store: TraceStore):
+        self.trace_store = store
+        self.kinetics.store = store
+        self.kinetic_results.store = store
 
     
-    def compute_area(self, data: list, dT: float) -> float:
-        previous_point = 0
-        area = 0
-
-        for point in data:
-            area_chunk = (previous_point + point) * dT * 0.5
-            area += area_chunk
-            previous_point = point
-        
+    ### Integrates along the last axis against the actual retention times, so non-uniform sampling is handled.
+    ### method is "trapezoid" or "simpson" (composite Simpson's rule for uneven spacing, the last interval of an odd count is
+    ### integrated with a quadratic through the last three points). Fewer than three points always use trapezoids.
+    def compute_area(self, data: np.ndarray, time: np.ndarray, method: str = "trapezoid") -> np.ndarray:
+        h = np.diff(time)
+
+        if method != "simpson" or len(time) < 3:
+            return np.sum((data[..., 1:] + data[..., :-1]) * h, axis=-1) * 0.5
+
+        pairs = (len(time) - 1) // 2
+        h0 = h[0 : 2 * pairs : 2]
+        h1 = h[1 : 2 * pairs : 2]
+        y0 = data[..., 0 : 2 * pairs : 2]
+        y1 = data[..., 1 : 2 * pairs : 2]
+        y2 = data[..., 2 : 2 * pairs + 1 : 2]
+        hsum = h0 + h1
+        area = np.sum(hsum / 6 * ((2 - h1 / h0) * y0 + hsum * hsum / (h0 * h1) * y1 + (2 - h0 / h1) * y2), axis=-1)
+
+        if (len(time) - 1) % 2 == 1:
+            h0 = h[-2]
+            h1 = h[-1]
+            alpha = (2 * h1 * h1 + 3 * h0 * h1) / (6 * (h0 + h1))
+            beta = (h1 * h1 + 3 * h0 * h1) / (6 * h0)
+            eta = h1 * h1 * h1 / (6 * h0 * (h0 + h1))
+            area = area + alpha * data[..., -1] + beta * data[..., -2] - eta * data[..., -3]
+
         return area
 
 
+    ### Areas of min-shifted windows for all channels and windows at once, returned as a (channels x windows) array.
+    ### With a window index, trapezoids come from its cumulative integral: the area of a window is the difference of two of its
+    ### values, and shifting by the window minimum removes min * (window duration). Otherwise each window is integrated on its own.
+    def compute_window_areas(self, time: np.ndarray, traces: np.ndarray, starts: np.ndarray, stops: np.ndarray, mins: np.ndarray, index: WindowIndex = None) -> np.ndarray:
+        if index != None and self.integration != "simpson":
+            return index.shifted_areas(starts=starts, stops=stops, mins=mins)
+
+        areas = np.empty(mins.shape, dtype=np.float64)
+        for w in range(0, len(starts)):
+            window = traces[:, starts[w] : stops[w] + 1] - mins[:, w, np.newaxis]
+            areas[:, w] = self.compute_area(data=window, time=time[starts[w] : stops[w] + 1], method=self.integration)
+        return areas
+
+
 
 
 
 ##################################### Saving results:
 
 
+    ### Workbooks are written in write-only mode: every sheet is built as whole rows and streamed to disk.
+    @profiled("save_height_data_to_file", points=lambda call, result: sum(r["height_normalised"].size for file in call["files"] for r in file.results))
     def save_height_data_to_file(self, save_directory: str, files: list):
-        wb = Workbook()
+        wb = self.make_height_workbook()
         
         for file in files:
-            sheet_name = os.path.basename(file.path)
-            ws = wb.create_sheet()
-            ws.title = sheet_name
-            self.write_height_data_set_to_worksheet(ws=ws, file=file)
+            self.add_height_sheet(wb=wb, file=file)
 
-        
+        self.close_height_workbook(wb=wb, save_directory=save_directory)
+
+
+    ### The three steps of save_height_data_to_file are also used on their own to write the sheets as files are processed.
+    def make_height_workbook(self) -> Workbook:
+        return Workbook(write_only=True)
+
+
+    @profiled("add_height_sheet", points=lambda call, result: sum(r["height_normalised"].size for r in call["file"].results))
+    def add_height_sheet(self, wb: Workbook, file: XLSXFile):
+        sheet_name = os.path.basename(file.path)
+        ws = wb.create_sheet(title=sheet_name)
+        self.write_height_data_set_to_worksheet(ws=ws, file=file)
+
+
+    @profiled("close_height_workbook")
+    def close_height_workbook(self, wb: Workbook, save_directory: str):
         filename = f"height_results.xlsx"
         wb_path = os.path.join(save_directory, filename)
-        sheet = wb["Sheet"]
-        wb.remove_sheet(sheet)
         wb.save(filename=wb_path)
         print(f"Saved height results to: {wb_path}")
 
 
     def write_height_data_set_to_worksheet(self, ws, file: XLSXFile):
-        column = 1
-        row = 1
+        columns = {}
         count = 0
 
         for result in file.results:
-            column += count * 10 + count
-
-            ws.cell(column=column, row=row).value = "RT (minutes)"
-            ws.cell(column=column + 1, row=row).value = str(result["detector_type"])
-            ws.cell(column=column + 2, row=row).value = "Parameters"
-            ws.cell(column=column + 3, row=row).value = "Values"
-
-            ws.cell(column=column + 2, row=row + 1).value = "Mode"
-            ws.cell(column=column + 3, row=row + 1).value = str(result["mode"])
-
-            ws.cell(column=column + 2, row=row + 2).value = "Detector type"
-            ws.cell(column=column + 3, row=row + 2).value = str(result["detector_type"])
-
-            ws.cell(column=column + 2, row=row + 3).value = "Start time"
-            ws.cell(column=column + 3, row=row + 3).value = result["start_time"]
-
-            ws.cell(column=column + 2, row=row + 4).value = "Stop time"
-            ws.cell(column=column + 3, row=row + 4).value = result["stop_time"]
-
-            ws.cell(column=column + 2, row=row + 5).value = "Number of points"
-            ws.cell(column=column + 3, row=row + 5).value = len(result["time"])
-
-            index = 0
-            row = 2
-
-            for time_point in result["time"]:
-                ws.cell(column=column, row=row + index).value = float(time_point)
-                ws.cell(column=column + 1, row=row + index).value = float(result["height_normalised"][index])
-                index += 1
-
-            values = Reference(ws, min_col=column + 1, min_row=1, max_col=column + 1, max_row=row + index)
-            x_values = Reference(ws, min_col=column, min_row=2, max_col=column, max_row=row + index)
-
-            chart = LineChart()
-            chart.add_data(values, titles_from_data = True)
-            chart.set_categories(x_values)
-            chart.title = f"{result['detector_type']}: {result['start_time']} - {result['stop_time']}"
-            chart.y_axis.title = f"{result['detector_type']} (normalised)"
-            chart.x_axis.title = "Retention Time (minutes)"
-            chart.legend = None
-            chart.y_axis.scaling.min = 0
-            chart.y_axis.scaling.max = 1.01
-            chart.height = 15
-            chart.y_axis.majorUnit = 1
-            number_of_points = len(result["time"]) / (float(result["stop_time"]) - float(result["start_time"]))
-            chart.x_axis.tickLblSkip = int(number_of_points)
-            placement = get_column_letter(column)
-            for series in chart.series:
-                series.graphicalProperties.line.width = 1
-            ws.add_chart(chart, f"{placement}7")
-
-            row = 1
-            column = 1
+            column = 1 + count * 10 + count
+            number_of_points = len(result["time"])
+
+            columns[column] = ["RT (minutes)"] + result["time"].tolist()
+            columns[column + 1] = [str(result["detector_type"])] + result["height_normalised"].tolist()
+            columns[column + 2] = ["Parameters", "Mode", "Detector type", "Start time", "Stop time", "Number of points"]
+            columns[column + 3] = ["Values", str(result["mode"]), str(result["detector_type"]), result["start_time"], result["stop_time"], number_of_points]
+
+            if self.charts:
+                chart_column = column
+                chart_points = number_of_points
+                indexes = self.chart_indexes(series=[result["height_normalised"]])
+                if indexes is not None:
+                    chart_column = column + 4
+                    chart_points = len(indexes)
+                    columns[chart_column] = ["Chart RT (minutes)"] + result["time"][indexes].tolist()
+                    columns[chart_column + 1] = [str(result["detector_type"])] + result["height_normalised"][indexes].tolist()
+
+                values = Reference(ws, min_col=chart_column + 1, min_row=1, max_col=chart_column + 1, max_row=chart_points + 2)
+                x_values = Reference(ws, min_col=chart_column, min_row=2, max_col=chart_column, max_row=chart_points + 2)
+
+                chart = LineChart()
+                chart.add_data(values, titles_from_data = True)
+                chart.set_categories(x_values)
+                chart.title = f"{result['detector_type']}: {result['start_time']} - {result['stop_time']}"
+                chart.y_axis.title = f"{result['detector_type']} (normalised)"
+                chart.x_axis.title = "Retention Time (minutes)"
+                chart.legend = None
+                chart.y_axis.scaling.min = 0
+                chart.y_axis.scaling.max = 1.01
+                chart.height = 15
+                chart.y_axis.majorUnit = 1
+                points_per_minute = chart_points / (float(result["stop_time"]) - float(result["start_time"]))
+                chart.x_axis.tickLblSkip = int(points_per_minute)
+                placement = get_column_letter(column)
+                for series in chart.series:
+                    series.graphicalProperties.line.width = 1
+                ws.add_chart(chart, f"{placement}7")
+
             count += 1
 
+        self.append_columns_to_worksheet(ws=ws, columns=columns)
+
         
+    @profiled("save_kinetics_data_to_file", points=lambda call, result: sum(block["kinetics_normalised"].size for block in call["self"].kinetic_results.blocks.values()))
     def save_kinetics_data_to_file(self, save_directory: str):
-        wb = Workbook()
+        wb = Workbook(write_only=True)
         
         for key in self.detector_keys:
             sheet_name = str(key)
-            ws = wb.create_sheet()
-            ws.title = sheet_name
+            ws = wb.create_sheet(title=sheet_name)
             self.write_kinetic_data_set_to_worksheet(ws=ws, detector_key=key)
 
-        
         filename = f"kinetic_results.xlsx"
         wb_path = os.path.join(save_directory, filename)
-        sheet = wb["Sheet"]
-        wb.remove_sheet(sheet)
         wb.save(filename=wb_path)
         print(f"Saved kinetic results to: {wb_path}")
 
 
     def write_kinetic_data_set_to_worksheet(self, ws, detector_key: str):
-        column = 1
-        row = 1
-        index = 2
+        columns = {}
         count = 0
 
         for key in self.kinetic_keys:
-            column += count * (self.number_of_files + 2) + count
+            column = 1 + count * (self.number_of_files + 2) + count
             number_of_points = 0
-            ws.cell(column=column, row=row).value = "Time range"
-            ws.cell(column=column, row=row + 1).value = str(key)
-            ws.cell(column=column + 1, row=row).value = "Time (minutes)"
-
-            for result in self.kinetic_results:
-                if result["detector_type"] == detector_key:
-                    if result["time_key"] == key:
-                        time = result["time"]
-                        i = 1
-                        for point in time:
-                            ws.cell(column=column + 1, row=row + i).value = float(point)
-                            i += 1
-                        number_of_points = float(len(time)) / (float(result["stop_time"]) - float(result["start_time"]))
-                        break
-
-            x_values = Reference(ws, min_col=column + 1, min_row=2, max_col=column + 1, max_row=row + 1)
-
-
-            for result in self.kinetic_results:
-                if result["detector_type"] == detector_key:
-                    if result["time_key"] == key:
-                        ws.cell(column=column + index, row=row).value = str(result["file_name"])
-                        data = result["kinetics_normalised"]
-                        i = 1
-                        for point in data:
-                            ws.cell(column=column + index, row=row + i).value = float(point)
-                            i += 1
-                        index += 1
-
-            values = Reference(ws, min_col=column + 2, min_row=1, max_col=column + index - 1, max_row=row + i)
-
-            chart = LineChart()
-            chart.add_data(values, titles_from_data = True)
-            chart.set_categories(x_values)
-            chart.title = f"{detector_key}: {key}"
-            chart.y_axis.title = f"{detector_key} (normalised)"
-            chart.x_axis.title = "Retention Time (minutes)"
-            chart.legend.position = "b"
-            chart.y_axis.scaling.min = 0
-            chart.y_axis.scaling.max = 1.01
-            chart.height = 20
-            chart.width = 30
-            chart.y_axis.majorUnit = 1
-            chart.x_axis.tickLblSkip = number_of_points
-            placement = get_column_letter(column)
-            for series in chart.series:
-                series.graphicalProperties.line.width = 1
-            ws.add_chart(chart, f"{placement}7")
-
+            max_row = 1
             index = 2
-            column = 1
-            row = 1
+            columns[column] = ["Time range", str(key)]
+            columns[column + 1] = ["Time (minutes)"]
+
+            block = self.kinetic_results.block(detector_key=detector_key, range_key=key)
+            if block != None:
+                time = block["time"]
+                columns[column + 1] += time.tolist()
+                number_of_points = float(len(time)) / (float(block["stop_time"]) - float(block["start_time"]))
+
+                for i, file_name in enumerate(block["file_names"]):
+                    length = int(block["lengths"][i])
+                    columns[column + index] = [str(file_name)] + block["kinetics_normalised"][i, :length].tolist()
+                    max_row = length + 2
+                    index += 1
+
+            if self.charts:
+                x_values = Reference(ws, min_col=column + 1, min_row=2, max_col=column + 1, max_row=2)
+                values = Reference(ws, min_col=column + 2, min_row=1, max_col=column + index - 1, max_row=max_row)
+                indexes = self.chart_indexes(series=[block["kinetics_normalised"][i, :block["lengths"][i]] for i in range(0, len(block["file_names"]))]) if block != None else None
+                if indexes is not None:
+                    first_row = self.add_kinetic_chart_rows(columns=columns, column=column, block=block, indexes=indexes)
+                    x_values = Reference(ws, min_col=column + 1, min_row=first_row + 1, max_col=column + 1, max_row=first_row + len(indexes))
+                    values = Reference(ws, min_col=column + 2, min_row=first_row, max_col=column + index - 1, max_row=first_row + len(indexes))
+                    number_of_points = float(len(indexes)) / (float(block["stop_time"]) - float(block["start_time"]))
+
+                chart = LineChart()
+                chart.add_data(values, titles_from_data = True)
+                chart.set_categories(x_values)
+                chart.title = f"{detector_key}: {key}"
+                chart.y_axis.title = f"{detector_key} (normalised)"
+                chart.x_axis.title = "Retention Time (minutes)"
+                chart.legend.position = "b"
+                chart.y_axis.scaling.min = 0
+                chart.y_axis.scaling.max = 1.01
+                chart.height = 20
+                chart.width = 30
+                chart.y_axis.majorUnit = 1
+                chart.x_axis.tickLblSkip = number_of_points
+                placement = get_column_letter(column)
+                for series in chart.series:
+                    series.graphicalProperties.line.width = 1
+                ws.add_chart(chart, f"{placement}7")
+
             count += 1
 
+        self.append_columns_to_worksheet(ws=ws, columns=columns)
 
 
+    ### Indexes of the points charted from the series, or None when the charts use the data columns as they are.
+    def chart_indexes(self, series: list) -> np.ndarray:
+        if self.chart_points == None:
+            return None
+        return decimate(series=series, points=self.chart_points, method=self.decimation)
 
-        
-    
+
+    ### Decimated chart series of a kinetic block are written under its data columns after an empty row, as there are no
+    ### free columns next to them. Returns the header row of the chart rows.
+    def add_kinetic_chart_rows(self, columns: dict, column: int, block: dict, indexes: np.ndarray) -> int:
+        first_row = max(len(columns[c]) for c in columns if c >= column) + 2
+        time = block["time"]
+        chart_columns = {
+            column: ["Chart data"],
+            column + 1: ["Time (minutes)"] + [float(time[i]) if i < len(time) else None for i in indexes],
+        }
+        for i, file_name in enumerate(block["file_names"]):
+            trace = block["kinetics_normalised"][i, :block["lengths"][i]]
+            chart_columns[column + 2 + i] = [str(file_name)] + [float(trace[j]) if j < len(trace) else None for j in indexes]
+
+        for c, values in chart_columns.items():
+            columns[c] = columns[c] + [None] * (first_row - 1 - len(columns[c])) + values
+
+        return first_row
+
+
+    ### Columns (column number -> values from row 1 down) are transposed into rows and appended one whole row at a time.
+    def append_columns_to_worksheet(self, ws, columns: dict) -> None:
+        if len(columns) == 0:
+            return
+
+        width = max(columns)
+        height = max(len(values) for values in columns.values())
+        rows = [[None] * width for _ in range(height)]
+
+        for column, values in columns.items():
+            for row, value in enumerate(values):
+                rows[row][column - 1] = value
+
+        for row in rows:
+            ws.append(row)
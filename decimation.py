@@ -0,0 +1,75 @@
+import numpy as np
+
+
+### Decimation of chart series. Both methods pick points out of buckets of equal width, so the picked points stay close to evenly
+### spaced and the shape is kept on the evenly spaced category axis of a LineChart. Both return sorted indexes of the kept points,
+### the first and last point are always kept. NaN points are never preferred over numbers.
+DECIMATION_METHODS = ("lttb", "minmax")
+
+
+### Largest-Triangle-Three-Buckets: one point per bucket, the one spanning the largest triangle with the point kept in the
+### previous bucket and the average of the next bucket. Positions are used as x, as that is how a LineChart spaces them.
+def lttb(y: np.ndarray, points: int) -> np.ndarray:
+    n = len(y)
+    if points >= n or points < 3:
+        return np.arange(n)
+
+    edges = (np.arange(points - 1) * (n - 2) / (points - 2)).astype(np.int64) + 1
+    indexes = np.empty(points, dtype=np.int64)
+    indexes[0] = 0
+    indexes[-1] = n - 1
+    selected = 0
+
+    for i in range(0, points - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_start, next_stop = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+
+        next_x = (next_start + next_stop - 1) * 0.5
+        next_y = np.nanmean(y[next_start:next_stop]) if np.any(~np.isnan(y[next_start:next_stop])) else y[selected]
+        candidates = np.arange(start, stop)
+        areas = np.abs((selected - next_x) * (y[candidates] - y[selected]) - (selected - candidates) * (next_y - y[selected]))
+
+        selected = start + int(np.argmax(np.where(np.isnan(areas), -1.0, areas)))
+        indexes[i + 1] = selected
+
+    return indexes
+
+
+### Min/max bucketing: the smallest and the largest point of every bucket, so no peak or dip is ever lost.
+def min_max(y: np.ndarray, points: int) -> np.ndarray:
+    n = len(y)
+    buckets = (points - 2) // 2
+    if points >= n or buckets < 1:
+        return np.arange(n)
+
+    size = -(-n // buckets)
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+
+    minima = offsets + np.argmin(np.where(np.isnan(padded), np.inf, padded), axis=1)
+    maxima = offsets + np.argmax(np.where(np.isnan(padded), -np.inf, padded), axis=1)
+    indexes = np.concatenate(([0, n - 1], minima, maxima))
+    return np.unique(indexes[indexes < n])
+
+
+### Shared indexes of series plotted on one category axis, at most points of them. Several series are reduced on their envelope:
+### half of the points go to the per-index maximum over the series and half to the per-index minimum, and the picked indexes are
+### merged, so every series is charted at all of the points. A single series (or too few points to split) is reduced on its own.
+### Returns None when all series already fit in the points.
+def decimate(series: list, points: int, method: str = "lttb") -> np.ndarray:
+    if len(series) == 0 or max(len(y) for y in series) <= points:
+        return None
+
+    reduce = lttb if method == "lttb" else min_max
+    stacked = np.full((len(series), max(len(y) for y in series)), np.nan)
+    for i, y in enumerate(series):
+        stacked[i, :len(y)] = y
+
+    upper = np.fmax.reduce(stacked, axis=0)
+    if len(series) == 1 or points < 8:
+        return reduce(y=upper, points=points)
+
+    lower = np.fmin.reduce(stacked, axis=0)
+    return np.unique(np.concatenate((reduce(y=upper, points=points // 2), reduce(y=lower, points=points - points // 2))))
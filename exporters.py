@@ -0,0 +1,287 @@
+from xlsxfile import XLSXFile
+from datamanipulator import DataManipulator
+from tracestore import TraceStore
+from profiler import profiled
+import numpy as np
+import os, shutil, zipfile, tempfile
+
+
+class Exporter():
+
+    ### Base of the result exporters. Height results are added file by file and written on close_height, kinetic results are
+    ### written from the manipulator's result store. Columnar exporters write both as long tables (one row per point).
+    ### A table is built from parts, one per trace, that hold the per-trace values once and views of the trace arrays.
+    ### Parts are only expanded to full columns while they are written, so the whole table is never held in memory.
+    ### Height parts added file by file (--stream) move their arrays into a temporary trace store as they arrive, so only their
+    ### per-trace values stay in memory until close_height, and no time axis of an earlier file is kept alive.
+    extension = None
+    batch_rows = 1 << 20
+
+    def __init__(self, manipulator: DataManipulator) -> None:
+        self.manipulator = manipulator
+        self.height_parts = []
+        self.height_store = None
+
+
+
+    ### All files are in memory already, so their parts are written as they are.
+    def save_height(self, save_directory: str, files: list) -> None:
+        self.height_parts = [part for file in files for part in self.make_height_parts(file=file)]
+        self.close_height(save_directory=save_directory)
+
+
+    def add_height_file(self, file: XLSXFile) -> None:
+        if self.height_store == None:
+            self.height_store = TraceStore(directory=tempfile.mkdtemp(prefix="height_parts_"))
+
+        for part in self.make_height_parts(file=file):
+            range_key = f"{part['start_time']} - {part['stop_time']}"
+            for name, value in part.items():
+                if isinstance(value, np.ndarray):
+                    part[name] = self.height_store.put(key=self.height_store.make_key(file_name=part["file_name"], channel=part["detector_type"], range_key=range_key, kind=name), array=value)
+            self.height_parts.append(part)
+
+
+    @profiled("close_height")
+    def close_height(self, save_directory: str) -> None:
+        path = os.path.join(save_directory, f"height_results.{self.extension}")
+        self.write_parts(parts=self.height_parts, path=path, table="height_results")
+        self.height_parts = []
+        print(f"Saved height results to: {path}")
+
+        if self.height_store != None:
+            directory = self.height_store.directory
+            self.height_store = None
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+    @profiled("save_kinetics")
+    def save_kinetics(self, save_directory: str) -> None:
+        parts = self.make_kinetic_parts()
+        path = os.path.join(save_directory, f"kinetic_results.{self.extension}")
+        self.write_parts(parts=parts, path=path, table="kinetic_results")
+        print(f"Saved kinetic results to: {path}")
+
+
+    def write_parts(self, parts: list, path: str, table: str) -> None:
+        raise NotImplementedError
+
+
+
+
+
+##################################### Long tables:
+
+
+    def make_height_parts(self, file: XLSXFile) -> list:
+        file_name = os.path.basename(file.path)
+        return [{
+            "file_name": file_name,
+            "detector_type": str(result["detector_type"]),
+            "start_time": float(result["start_time"]),
+            "stop_time": float(result["stop_time"]),
+            "time": result["time"],
+            "height_normalised": result["height_normalised"],
+        } for result in file.results]
+
+
+    ### Traces longer than the time axis of their block get NaN times past its end.
+    def make_kinetic_parts(self) -> list:
+        parts = []
+
+        for block in self.manipulator.kinetic_results.blocks.values():
+            time = block["time"]
+            for i, file_name in enumerate(block["file_names"]):
+                length = int(block["lengths"][i])
+                if length <= len(time):
+                    file_time = time[:length]
+                else:
+                    file_time = np.full(length, np.nan)
+                    file_time[:len(time)] = time
+                parts.append({
+                    "file_name": str(file_name),
+                    "detector_type": str(block["detector_type"]),
+                    "time_key": str(block["time_key"]),
+                    "start_time": float(block["start_time"]),
+                    "stop_time": float(block["stop_time"]),
+                    "time": file_time,
+                    "kinetics_normalised": block["kinetics_normalised"][i, :length],
+                })
+
+        return parts
+
+
+    def part_length(self, part: dict) -> int:
+        return next(len(value) for value in part.values() if isinstance(value, np.ndarray))
+
+
+    ### Per-trace values are repeated over the rows of the part, arrays are used as they are.
+    def expand_column(self, part: dict, name: str, length: int) -> np.ndarray:
+        value = part[name]
+        if isinstance(value, np.ndarray):
+            return np.asarray(value, dtype=np.float64)
+        return np.full(length, value)
+
+
+    ### Common dtype of a column over all parts: float64, or a string type long enough for the longest value.
+    def column_dtype(self, parts: list, name: str) -> np.dtype:
+        dtype = None
+        for part in parts:
+            value = part[name]
+            part_dtype = np.dtype(np.float64) if isinstance(value, np.ndarray) else np.array(value).dtype
+            dtype = part_dtype if dtype == None else np.promote_types(dtype, part_dtype)
+        return dtype
+
+
+    ### Consecutive parts expanded and concatenated into column dicts of about batch_rows rows each.
+    def batches(self, parts: list):
+        batch = []
+        rows = 0
+
+        for part in parts:
+            length = self.part_length(part=part)
+            batch.append({name: self.expand_column(part=part, name=name, length=length) for name in part})
+            rows += length
+            if rows >= self.batch_rows:
+                yield self.concatenate_columns(parts=batch)
+                batch = []
+                rows = 0
+
+        if len(batch) > 0:
+            yield self.concatenate_columns(parts=batch)
+
+
+    def concatenate_columns(self, parts: list) -> dict:
+        parts = [part for part in parts if len(part) > 0]
+        if len(parts) == 0:
+            return {}
+
+        return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+
+
+
+##################################### Backends:
+
+
+### Keeps the original workbook layout (and charts) by delegating to the DataManipulator writers.
+class XLSXExporter(Exporter):
+
+    extension = "xlsx"
+
+    def __init__(self, manipulator: DataManipulator) -> None:
+        super().__init__(manipulator=manipulator)
+        self.wb = None
+
+
+    def save_height(self, save_directory: str, files: list) -> None:
+        self.manipulator.save_height_data_to_file(save_directory=save_directory, files=files)
+
+
+    def add_height_file(self, file: XLSXFile) -> None:
+        if self.wb == None:
+            self.wb = self.manipulator.make_height_workbook()
+        self.manipulator.add_height_sheet(wb=self.wb, file=file)
+
+
+    def close_height(self, save_directory: str) -> None:
+        if self.wb == None:
+            self.wb = self.manipulator.make_height_workbook()
+        self.manipulator.close_height_workbook(wb=self.wb, save_directory=save_directory)
+        self.wb = None
+
+
+    def save_kinetics(self, save_directory: str) -> None:
+        self.manipulator.save_kinetics_data_to_file(save_directory=save_directory)
+
+
+### Columns are written one at a time into the archive, part by part, in the same .npy format np.savez_compressed writes.
+class NPZExporter(Exporter):
+
+    extension = "npz"
+
+    def write_parts(self, parts: list, path: str, table: str) -> None:
+        names = list(parts[0]) if len(parts) > 0 else []
+        lengths = [self.part_length(part=part) for part in parts]
+
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+            for name in names:
+                dtype = self.column_dtype(parts=parts, name=name)
+                with archive.open(f"{name}.npy", "w", force_zip64=True) as f:
+                    np.lib.format.write_array_header_1_0(f, {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (sum(lengths),)})
+                    for part, length in zip(parts, lengths):
+                        f.write(self.expand_column(part=part, name=name, length=length).astype(dtype, copy=False).tobytes())
+
+
+class ParquetExporter(Exporter):
+
+    extension = "parquet"
+
+    def write_parts(self, parts: list, path: str, table: str) -> None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            exit("Parquet output needs the pyarrow package. Install it with: pip install pyarrow")
+
+        writer = None
+        try:
+            for columns in self.batches(parts=parts):
+                batch = pyarrow.table(columns)
+                if writer == None:
+                    writer = pyarrow.parquet.ParquetWriter(path, batch.schema)
+                writer.write_table(batch)
+        finally:
+            if writer != None:
+                writer.close()
+
+        if writer == None:
+            pyarrow.parquet.write_table(pyarrow.table({}), path)
+
+
+### Datasets are created at their full length up front and filled batch by batch.
+class HDF5Exporter(Exporter):
+
+    extension = "h5"
+
+    def write_parts(self, parts: list, path: str, table: str) -> None:
+        try:
+            import h5py
+        except ImportError:
+            exit("HDF5 output needs the h5py package. Install it with: pip install h5py")
+
+        names = list(parts[0]) if len(parts) > 0 else []
+        rows = sum(self.part_length(part=part) for part in parts)
+
+        with h5py.File(path, "w") as f:
+            group = f.create_group(table)
+            for name in names:
+                dtype = self.column_dtype(parts=parts, name=name)
+                if dtype.kind == "U":
+                    dtype = np.dtype(f"S{max(len(str(part[name]).encode('utf-8')) for part in parts)}")
+                group.create_dataset(name, shape=(rows,), dtype=dtype, compression="gzip")
+
+            offset = 0
+            for columns in self.batches(parts=parts):
+                length = len(next(iter(columns.values())))
+                for name, values in columns.items():
+                    if values.dtype.kind == "U":
+                        values = np.char.encode(values, "utf-8")
+                    group[name][offset : offset + length] = values
+                offset += length
+
+
+EXPORTERS = {
+    "xlsx": XLSXExporter,
+    "npz": NPZExporter,
+    "parquet": ParquetExporter,
+    "hdf5": HDF5Exporter,
+}
+
+
+def get_exporter(format: str, manipulator: DataManipulator) -> Exporter:
+    key = format.lower().strip()
+    if key not in EXPORTERS:
+        exit(f"Incorrect output format has been provided: {format}. Please adjust you input to one of:\n\n" + "\n".join(EXPORTERS))
+    return EXPORTERS[key](manipulator=manipulator)
@@ -0,0 +1,160 @@
+from tracestore import TraceStore
+import numpy as np
+import os, json
+
+
+class KineticResults():
+
+    ### Kinetic results are held in blocks indexed by (detector, range key). Each block keeps the time axis of the range,
+    ### the file names and a single (files x points) matrix. Traces are resampled onto the time axis of their range, so all rows
+    ### have its length, traces of state files from before resampling that are shorter are padded with NaN.
+    ### With a trace store, the matrices are allocated in it instead of in memory.
+    def __init__(self, store: TraceStore = None) -> None:
+        self.blocks = {}
+        self.file_indexes = {}
+        self.store = store
+
+
+
+    def add_block(self, detector_key: str, range_key: str, start: float, stop: float, time: np.ndarray, file_names: list, traces: list) -> None:
+        lengths = np.array([len(trace) for trace in traces], dtype=np.int64)
+        shape = (len(traces), int(lengths.max()) if len(traces) > 0 else 0)
+        if self.store != None:
+            matrix = self.store.allocate(key=self.store.make_key(file_name=None, channel=detector_key, range_key=range_key, kind="kinetics_normalised"), shape=shape)
+            matrix[...] = np.nan
+        else:
+            matrix = np.full(shape, np.nan, dtype=np.float64)
+
+        for i, trace in enumerate(traces):
+            matrix[i, :lengths[i]] = trace
+
+        self.blocks[(detector_key, range_key)] = {
+            "detector_type": detector_key,
+            "time_key": range_key,
+            "start_time": start,
+            "stop_time": stop,
+            "time": time,
+            "file_names": list(file_names),
+            "lengths": lengths,
+            "kinetics_normalised": matrix,
+        }
+        self.file_indexes[(detector_key, range_key)] = {name: i for i, name in enumerate(file_names)}
+
+
+    ### Bulk accessor: the block of one range for all files, or None if there is no such result.
+    def block(self, detector_key: str, range_key: str) -> dict:
+        return self.blocks.get((detector_key, range_key))
+
+
+    ### Normalised trace of a single file, or None if there is no such result.
+    def get(self, detector_key: str, range_key: str, file_name: str) -> np.ndarray:
+        block = self.block(detector_key=detector_key, range_key=range_key)
+        if block == None:
+            return None
+
+        i = self.file_indexes[(detector_key, range_key)].get(file_name)
+        if i == None:
+            return None
+
+        return block["kinetics_normalised"][i, :block["lengths"][i]]
+
+
+    def __len__(self) -> int:
+        return sum(len(block["file_names"]) for block in self.blocks.values())
+
+
+
+
+class KineticAccumulator():
+
+    ### Running state of a kinetic normalisation that files are added to one at a time. Per (detector, range key) it keeps only
+    ### each file's min-shifted window divided by its area and the largest height / area ratio seen so far.
+    ### With a trace store, the unit-area traces are kept in it instead of in memory.
+    def __init__(self, store: TraceStore = None) -> None:
+        self.ranges = {}
+        self.entries = {}
+        self.store = store
+
+
+
+    ### The time of a range is set by the first file added to it, later traces are expected on the same grid.
+    def add(self, detector_key: str, range_key: str, start: float, stop: float, time: np.ndarray, file_name: str, unit_area_trace: np.ndarray, ratio: float) -> None:
+        self.ranges.setdefault(range_key, {"start": start, "stop": stop, "time": time})
+        if self.store != None:
+            unit_area_trace = self.store.put(key=self.store.make_key(file_name=file_name, channel=detector_key, range_key=range_key, kind="unit_area"), array=unit_area_trace)
+        entry = self.entries.setdefault((detector_key, range_key), {"file_names": [], "traces": [], "ratios": [], "max_ratio": ratio})
+        entry["file_names"].append(file_name)
+        entry["traces"].append(unit_area_trace)
+        entry["ratios"].append(float(ratio))
+        entry["max_ratio"] = max(entry["max_ratio"], ratio)
+
+
+    def grid(self, range_key: str) -> np.ndarray:
+        time_range = self.ranges.get(range_key)
+        return time_range["time"] if time_range != None else None
+
+
+    def file_names(self) -> list:
+        names = []
+        for entry in self.entries.values():
+            for name in entry["file_names"]:
+                if name not in names:
+                    names.append(name)
+        return names
+
+
+    ### Final results are the unit-area traces divided by the largest height / area ratio of their detector and range.
+    def write_results(self, results: KineticResults) -> None:
+        for (detector_key, range_key), entry in self.entries.items():
+            time_range = self.ranges[range_key]
+            traces = [trace / entry["max_ratio"] for trace in entry["traces"]]
+            results.add_block(detector_key=detector_key, range_key=range_key, start=time_range["start"], stop=time_range["stop"], time=time_range["time"], file_names=entry["file_names"], traces=traces)
+
+
+    ### State file (.npz without pickled objects): a JSON header with the ranges and entries, the time axis of every range
+    ### and the unit-area traces of every entry concatenated into one array.
+    def save(self, path: str) -> None:
+        range_keys = list(self.ranges)
+        header = {
+            "ranges": [[key, self.ranges[key]["start"], self.ranges[key]["stop"]] for key in range_keys],
+            "entries": [],
+        }
+        arrays = {}
+
+        for i, key in enumerate(range_keys):
+            arrays[f"time_{i}"] = np.asarray(self.ranges[key]["time"], dtype=np.float64)
+
+        for i, ((detector_key, range_key), entry) in enumerate(self.entries.items()):
+            header["entries"].append({
+                "detector_type": detector_key,
+                "time_key": range_key,
+                "file_names": entry["file_names"],
+                "ratios": entry["ratios"],
+                "max_ratio": float(entry["max_ratio"]),
+                "lengths": [len(trace) for trace in entry["traces"]],
+            })
+            arrays[f"traces_{i}"] = np.concatenate(entry["traces"]) if len(entry["traces"]) > 0 else np.empty(0)
+
+        temp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(temp_path, header=np.array(json.dumps(header)), **arrays)
+        os.replace(temp_path, path)
+
+
+    def load(self, path: str) -> None:
+        with np.load(path, allow_pickle=False) as npz:
+            header = json.loads(str(npz["header"]))
+
+            for i, (key, start, stop) in enumerate(header["ranges"]):
+                self.ranges[key] = {"start": start, "stop": stop, "time": npz[f"time_{i}"]}
+
+            for i, entry in enumerate(header["entries"]):
+                offsets = np.cumsum([0] + entry["lengths"])
+                traces = npz[f"traces_{i}"]
+                if self.store != None:
+                    traces = self.store.put(key=self.store.make_key(file_name=None, channel=entry["detector_type"], range_key=entry["time_key"], kind="state"), array=traces)
+                self.entries[(entry["detector_type"], entry["time_key"])] = {
+                    "file_names": entry["file_names"],
+                    "traces": [traces[offsets[j] : offsets[j + 1]] for j in range(0, len(entry["lengths"]))],
+                    "ratios": entry["ratios"],
+                    "max_ratio": entry["max_ratio"],
+                }
@@ -1,8 +1,14 @@
-from xlsxfile import XLSXFile
+from xlsxfile import XLSXFile, read_xlsx_data
+from readers import EXTENSIONS, is_supported_file
+from parsecache import ParseCache, MemoryParseCache
+from tracestore import TraceStore
+from profiler import PROFILER
+from exporters import Exporter, EXPORTERS, get_exporter
 from datamanipulator import DataManipulator
-from tkinter import Tk, messagebox
-from tkinter.filedialog import askopenfilenames, askdirectory
-import os, argparse
+from watcher import DirectoryWatcher
+from server import NormalisationServer
+from concurrent.futures import ProcessPoolExecutor
+import os, glob, argparse
 
 
 # Create the parser
@@ -11,45 +17,68 @@ my_parser = argparse.ArgumentParser(prog="GPC Normaliser",
                                     description='GDB GPC Normalisation Tool v1.0 by KS')
 
 # Add the arguments
-my_parser.add_argument("-m", "--mode", action='store', type=str, required=True, help="usage: -m [arg] where [arg] can be: kientic -> kinetic normalisation of the set only. height -> height normalisation of the set only. both -> both kinetic and height normlisation will be performed on the set.")
-my_parser.add_argument("-r", "--ranges", action='store', nargs="+", type=str, required=True, help="usage: -r [arg...] where [arg...] are specified as follows: [start_time_1 stop_time_1 start_time_2 stop_time_2 start_time_3 stop_time_3]")
+my_parser.add_argument("-m", "--mode", action='store', type=str, required=False, help="usage: -m [arg] where [arg] can be: kientic -> kinetic normalisation of the set only. height -> height normalisation of the set only. both -> both kinetic and height normlisation will be performed on the set.")
+my_parser.add_argument("-r", "--ranges", action='store', nargs="+", type=str, required=False, help="usage: -r [arg...] where [arg...] are specified as follows: [start_time_1 stop_time_1 start_time_2 stop_time_2 start_time_3 stop_time_3]")
 my_parser.add_argument("-c", "--combination", action="store_true", default=False, required=False, help="usage: -c true -> (defaults to false if not called) overrides the format of the input of the of start and stop times in --ranges argument: [start_time_1 start_time_2 ... ! stop_time_1 stop_time_2 ...] The colletion does not have to have equal number of start and stop times, the combination of all will be generated.")
+my_parser.add_argument("--integration", action="store", type=str, default="trapezoid", required=False, help="usage: --integration [arg] -> (defaults to trapezoid) method used to compute peak areas for kinetic normalisation: trapezoid or simpson. Both integrate against the actual retention times.")
+my_parser.add_argument("-j", "--jobs", action="store", type=int, default=1, required=False, help="usage: -j [N] -> (defaults to 1) number of worker processes used to read the selected files concurrently. With mode both and N > 1, the height and kinetic result files are also written concurrently, each in its own process (not with --trace-store).")
+my_parser.add_argument("--cache-dir", action="store", type=str, default=None, required=False, help="usage: --cache-dir [path] -> directory of the parse cache. Data extracted from each file is stored there and reused on later runs while the file is unchanged. Caching is off if not called.")
+my_parser.add_argument("--cache-size", action="store", type=float, default=512, required=False, help="usage: --cache-size [MB] -> (defaults to 512) size limit of the parse cache, least recently used entries are removed above it.")
+my_parser.add_argument("--channels", action="store", nargs="+", type=str, default=None, required=False, help="usage: --channels [arg...] -> detector types (e.g. RI) or channel IDs to normalise. Only the time axis and these channels are kept when the files are read, the other channels are skipped. All channels are used if not called.")
+my_parser.add_argument("--trace-store", action="store", type=str, default=None, required=False, help="usage: --trace-store [path] -> directory of a memory-mapped store the raw traces and all normalised results are kept in instead of in RAM, for batches too large for memory. Its traces.bin and index.json are overwritten on every run and can be deleted afterwards. Not used by --watch.")
+my_parser.add_argument("-i", "--input", action="store", nargs="+", type=str, default=None, required=False, help=f"usage: -i [path...] -> files, directories (all {', '.join(EXTENSIONS)} files inside) or glob patterns to normalise. Delimited text exports (comma, semicolon or tab) need the same \"Channel ID\" / \"RT (mins)\" layout as the \"Raw Data\" sheet, files with other extensions are recognised by their content. A file dialog is shown if not called.")
+my_parser.add_argument("-s", "--stream", action="store_true", default=False, required=False, help="usage: -s -> (defaults to false if not called) process the files one at a time: each file is read, normalised and its height results written before the next one is read. Only the extracted windows needed for kinetic normalisation are kept, so memory does not grow with the raw data of the set. --jobs is ignored in this mode.")
+my_parser.add_argument("-w", "--watch", action="store", type=str, default=None, required=False, help="usage: -w [path] -> keep running and normalise every supported file written into this directory (files already there included) once the instrument has finished writing it. Result files (and the --state file) are updated after every new file, height results cover the files normalised since the watch started. --input and --stream are ignored in this mode, --jobs sets the number of worker processes reading the files. Stop with Ctrl+C.")
+my_parser.add_argument("--poll-interval", action="store", type=float, default=2.0, required=False, help="usage: --poll-interval [seconds] -> (defaults to 2) with --watch, how often the directory is checked. A file is read once its size and modification time have not changed for this long.")
+my_parser.add_argument("-f", "--format", action="store", type=str, default="xlsx", required=False, help=f"usage: -f [arg] -> (defaults to xlsx) format of the result files, one of: {', '.join(EXPORTERS)}. Formats other than xlsx are written as long tables with one row per point (parquet needs pyarrow, hdf5 needs h5py).")
+my_parser.add_argument("--no-charts", action="store_true", default=False, required=False, help="usage: --no-charts -> do not add line charts to the xlsx result files.")
+my_parser.add_argument("--chart-points", action="store", type=int, default=None, required=False, help="usage: --chart-points [N] -> charts of the xlsx result files show at most N points per chart. Longer series are decimated into chart-only cells (next to the height data, under the kinetic data), the data columns keep every point. Charts use all points if not called.")
+my_parser.add_argument("--decimation", action="store", type=str, default="lttb", required=False, help="usage: --decimation [arg] -> (defaults to lttb) how --chart-points picks the charted points: lttb (largest triangle three buckets, keeps the visual shape) or minmax (smallest and largest point of every bucket, keeps every peak).")
+my_parser.add_argument("--state", action="store", type=str, default=None, required=False, help="usage: --state [path] -> incremental kinetic normalisation: the kinetic state of previous runs is read from this file (if it exists), only files not already in it are added, and the updated state is written back. The kinetic results cover all files in the state. In the kinetic mode files already in the state are not read, in the both mode they are still height normalised, so the height results cover all selected files. The same --ranges have to be used on every run.")
+my_parser.add_argument("--serve", action="store", nargs="?", type=int, default=None, const=8765, required=False, help="usage: --serve [port] -> (port defaults to 8765) run as a resident server on 127.0.0.1 instead of normalising once. Jobs are POSTed to /jobs as a JSON object of the long options of this tool, e.g. {\"mode\": \"both\", \"ranges\": [\"10\", \"20\"], \"input\": [\"examples\"], \"output\": \"results\"}, and answered once they have finished. Jobs run concurrently, each with its own state. Parsed files are kept in memory (up to --cache-size MB, backed by --cache-dir if called) and reused by later jobs while they are unchanged. GET /status reports the jobs and the cache. --mode and --ranges are not needed in this mode.")
+my_parser.add_argument("--profile", action="store", nargs="?", type=str, default=None, const="", required=False, help="usage: --profile [path] -> print time, points processed and memory allocated per stage (reading, extraction, normalisation, saving) at the end of the run. If a path is given the same data is also written there as JSON. Not available with --serve.")
+my_parser.add_argument("--profile-no-memory", action="store_true", default=False, required=False, help="usage: --profile-no-memory -> with --profile, skip tracking of memory allocations (tracemalloc), which otherwise slows reading of the files down.")
+my_parser.add_argument("-o", "--output", action="store", type=str, default=None, required=False, help="usage: -o [path] -> directory the results are saved in, created if it does not exist. A directory dialog is shown if not called.")
 
 
-Tk().withdraw()
 CWD = os.path.dirname(__file__)
 DAT = DataManipulator()
-ARGS = my_parser.parse_args()
-print("\n\n")
 
 
 
+### Directories are expanded to the supported files inside them (Excel lock files skipped) and glob patterns to their matches.
+def expand_input_paths(inputs: list) -> list:
+    paths = []
 
-def main(args):
-    mode = DAT.check_mode(arg=args.mode)
-    ranges = DAT.check_ranges_input(args=args.ranges, combination=args.combination)
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = sorted(os.path.join(item, name) for name in os.listdir(item) if is_supported_file(name=name))
+        elif glob.has_magic(item):
+            matches = sorted(glob.glob(item))
+        else:
+            matches = [item]
 
-    paths = askopenfilenames(title="Select your data set:")
-    if len(paths) == 0:
-        exit("No paths were provided... Try again wiht some files...")
-    if len(ranges) < 1:
-        exit("Could not have parsed your time ranges, please double check your input.")
-    files = [XLSXFile(path=path) for path in paths]
-    DAT.number_of_files = len(files)
-    print("\n\nExtraction and normalisation in progress...")
+        for path in matches:
+            if path not in paths:
+                paths.append(path)
 
-    for range in ranges:
-        for file in files:
-            if mode == "height":
-                DAT.height_normalise(file=file, start=range[0], stop=range[1])
-            elif mode == "both":
-                DAT.height_normalise(file=file, start=range[0], stop=range[1])
-        
-        if mode != "height":
-            DAT.kinetic_normalise(files=files, start=range[0], stop=range[1])
+    return paths
 
-    print("Normalisation complete...")
 
+### tkinter is only imported when a dialog is actually needed, so batch runs work on machines without a display.
+def ask_for_paths() -> tuple:
+    from tkinter import Tk
+    from tkinter.filedialog import askopenfilenames
+
+    Tk().withdraw()
+    return askopenfilenames(title="Select your data set:")
+
+
+def ask_for_save_directory() -> str:
+    from tkinter import Tk, messagebox
+    from tkinter.filedialog import askdirectory
+
+    Tk().withdraw()
     while True:
         dir_name = askdirectory(title="Save the results in directory:")
         if dir_name == "" or dir_name == None:
@@ -57,20 +86,261 @@ def main(args):
             if answer == False:
                 exit("Your nomalisation data was not saved.")
         else:
-            break
+            return dir_name
+
+
+### The cache is only read and written in this process, workers just parse the files that missed it.
+### Files read with a channel selection are partial, so they are not put in the cache.
+### Each future is dropped once its file is loaded, so with a trace store the parsed data of only one file is held in memory at a time.
+def load_files(paths: tuple, jobs: int, cache: ParseCache = None, channels: list = None, store: TraceStore = None) -> list:
+    files = []
+
+    if jobs > 1:
+        cached = {path: cache.get(path=path) for path in paths} if cache != None else {}
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = {path: executor.submit(read_xlsx_data, path, channels) for path in paths if cached.get(path) == None}
+            for path in paths:
+                try:
+                    if cached.get(path) != None:
+                        files.append(XLSXFile(path=path, data=cached.pop(path), channels=channels, store=store))
+                        continue
+                    data = results.pop(path).result()
+                    if cache != None and channels == None:
+                        cache.put(path=path, data=data)
+                    files.append(XLSXFile(path=path, data=data, store=store))
+                except Exception as error:
+                    print(f"Skipping {os.path.basename(path)}:\n{error}")
+    else:
+        for path in paths:
+            try:
+                files.append(XLSXFile(path=path, cache=cache, channels=channels, store=store))
+            except Exception as error:
+                print(f"Skipping {os.path.basename(path)}:\n{error}")
+
+    return files
+
 
+
+
+def get_save_directory(output: str) -> str:
+    if output == None:
+        return ask_for_save_directory()
+
+    os.makedirs(output, exist_ok=True)
+    return output
+
+
+### Files are read, height normalised and written one at a time, kinetics only keep the extracted windows until the end.
+### Module level, so the height and kinetic results can be written in separate worker processes. The exporter (with its
+### manipulator) and the files are pickled over, so each process works on its own copy of the results.
+def save_results(exporter: Exporter, mode: str, save_directory: str, files: list) -> None:
+    if mode == "height":
+        exporter.save_height(save_directory=save_directory, files=files)
+    else:
+        exporter.save_kinetics(save_directory=save_directory)
+
+
+### With a loaded kinetic state, files already in it are still height normalised in the both mode, but not added to the kinetics again.
+def get_file_mode(mode: str, path: str, known_files: list) -> str:
+    if mode == "both" and known_files != None and os.path.basename(path) in known_files:
+        return "height"
+    return mode
+
+
+def stream(manipulator: DataManipulator, paths: list, mode: str, ranges: list, save_directory: str, exporter: Exporter, cache: ParseCache = None, channels: list = None, known_files: list = None) -> int:
+    number_of_files = 0
+
+    for path in paths:
+        try:
+            file = XLSXFile(path=path, cache=cache, channels=channels)
+        except Exception as error:
+            print(f"Skipping {os.path.basename(path)}:\n{error}")
+            continue
+
+        number_of_files += 1
+        manipulator.normalise_file(file=file, ranges=ranges, mode=get_file_mode(mode=mode, path=path, known_files=known_files))
+        if mode != "kinetic":
+            exporter.add_height_file(file=file)
+
+    if number_of_files == 0:
+        exit("None of the selected files could have been read... Try again with some .xlsx or text export files...")
+
+    print("Normalisation complete...")
     print("Saving results...\n\n")
+
+    if mode != "kinetic":
+        exporter.close_height(save_directory=save_directory)
+    if mode != "height":
+        manipulator.number_of_files = len(manipulator.kinetics.file_names())
+        manipulator.finish_kinetics()
+        exporter.save_kinetics(save_directory=save_directory)
+
+    return number_of_files
+
+
+### The whole run on the given manipulator, used once by main and once per job by the server. Returns a summary of the run.
+def normalise(args, manipulator: DataManipulator, cache: ParseCache = None) -> dict:
+    mode = manipulator.check_mode(arg=args.mode)
+    ranges = manipulator.check_ranges_input(args=args.ranges, combination=args.combination)
+
+    if args.watch != None:
+        if not os.path.isdir(args.watch):
+            exit(f"The watched directory does not exist: {args.watch}")
+        paths = []
+    else:
+        paths = expand_input_paths(inputs=args.input) if args.input != None else ask_for_paths()
+        if len(paths) == 0:
+            exit("No paths were provided... Try again wiht some files...")
+    if len(ranges) < 1:
+        exit("Could not have parsed your time ranges, please double check your input.")
+    if args.jobs < 1:
+        exit(f"Number of jobs has to be at least 1, {args.jobs} was provided.")
+    if args.chart_points != None and args.chart_points < 4:
+        exit(f"Number of chart points has to be at least 4, {args.chart_points} was provided.")
+    if args.poll_interval <= 0:
+        exit(f"Poll interval has to be a positive number of seconds, {args.poll_interval} was provided.")
+    store = None
+    if args.trace_store != None and args.watch == None:
+        store = TraceStore(directory=args.trace_store)
+        manipulator.use_trace_store(store=store)
+
+    known_files = []
+    if args.state != None:
+        if mode == "height":
+            exit("--state is only used by kinetic normalisation, please use it with the kinetic or both mode.")
+        if os.path.exists(args.state):
+            known_files = manipulator.load_kinetics_state(path=args.state, ranges=ranges)
+            if args.watch != None:
+                print(f"Loaded kinetic state of {len(known_files)} file(s) from: {args.state}, files already in it will not be normalised again.")
+            else:
+                new_paths = [path for path in paths if os.path.basename(path) not in known_files]
+                print(f"Loaded kinetic state of {len(known_files)} file(s) from: {args.state}, {len(paths) - len(new_paths)} of the selected files are already in it.")
+                if mode == "kinetic":
+                    paths = new_paths
+                    if len(paths) == 0:
+                        exit("All of the selected files are already in the kinetic state, there is nothing to add.")
+
+    exporter = get_exporter(format=args.format, manipulator=manipulator)
+    manipulator.charts = not args.no_charts
+    manipulator.integration = manipulator.check_integration(arg=args.integration)
+    manipulator.chart_points = args.chart_points
+    manipulator.decimation = manipulator.check_decimation(arg=args.decimation)
+
+    if args.watch != None:
+        dir_name = get_save_directory(output=args.output)
+        watcher = DirectoryWatcher(directory=args.watch, mode=mode, ranges=ranges, save_directory=dir_name, manipulator=manipulator, exporter=exporter, jobs=args.jobs, interval=args.poll_interval, settle=args.poll_interval, channels=args.channels, state=args.state)
+        watcher.skip_files(file_names=known_files)
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            print("\nStopped watching.")
+        number_of_files = len(watcher.files)
+    elif args.stream:
+        dir_name = get_save_directory(output=args.output)
+        print("\n\nExtraction and normalisation in progress...")
+        number_of_files = stream(manipulator=manipulator, paths=paths, mode=mode, ranges=ranges, save_directory=dir_name, exporter=exporter, cache=cache, channels=args.channels, known_files=known_files)
+    else:
+        files = load_files(paths=paths, jobs=args.jobs, cache=cache, channels=args.channels, store=store)
+        if len(files) == 0:
+            exit("None of the selected files could have been read... Try again with some .xlsx or text export files...")
+        number_of_files = len(files)
+        manipulator.number_of_files = number_of_files
+        print("\n\nExtraction and normalisation in progress...")
+
+        for file in files:
+            manipulator.normalise_file(file=file, ranges=ranges, mode=get_file_mode(mode=mode, path=file.path, known_files=known_files))
             
-    if mode == "height":
-        DAT.save_height_data_to_file(save_directory=dir_name, files=files)
-    elif mode == "kinetic":
-        DAT.save_kinetics_data_to_file(save_directory=dir_name)
+        if mode != "height":
+            manipulator.finish_kinetics()
+            manipulator.number_of_files = len(manipulator.kinetics.file_names())
+
+        print("Normalisation complete...")
+
+        dir_name = get_save_directory(output=args.output)
+
+        print("Saving results...\n\n")
+                
+        if mode == "both" and args.jobs > 1 and store == None:
+            with ProcessPoolExecutor(max_workers=2) as executor:
+                futures = [executor.submit(save_results, exporter, "height", dir_name, files), executor.submit(save_results, exporter, "kinetic", dir_name, [])]
+                for future in futures:
+                    future.result()
+        else:
+            if mode != "kinetic":
+                exporter.save_height(save_directory=dir_name, files=files)
+            if mode != "height":
+                exporter.save_kinetics(save_directory=dir_name)
+
+    if args.state != None:
+        manipulator.save_kinetics_state(path=args.state)
+        print(f"Saved kinetic state to: {args.state}")
+
+    if store != None:
+        store.close()
+        print(f"Trace store of {store.size * 8 / 1e6:.1f} MB left in: {args.trace_store}")
+
+    return {"output": os.path.abspath(dir_name), "files": number_of_files}
+
+
+### A job is a dict of the long options of the tool (without the leading dashes, - or _ between words), parsed like the command line.
+### Each job gets its own DataManipulator, so nothing is shared between jobs apart from the parse cache.
+def run_job(job: dict, cache: MemoryParseCache) -> dict:
+    for name in ("serve", "watch", "profile", "profile-no-memory", "cache-dir", "cache-size"):
+        if name in job or name.replace("-", "_") in job:
+            exit(f"{name} is a setting of the server and cannot be used in a job.")
+    for name in ("mode", "ranges", "input", "output"):
+        if name not in job:
+            exit(f"A job has to set {name}.")
+
+    argv = []
+    for name, value in job.items():
+        option = "--" + name.replace("_", "-")
+        if value is True:
+            argv.append(option)
+        elif isinstance(value, list):
+            argv += [option] + [str(item) for item in value]
+        elif value is not False and value != None:
+            argv += [option, str(value)]
+
+    return normalise(args=my_parser.parse_args(argv), manipulator=DataManipulator(), cache=cache)
+
+
+def serve(port: int, cache: MemoryParseCache) -> None:
+    server = NormalisationServer(address=("127.0.0.1", port), run_job=lambda job: run_job(job=job, cache=cache), cache=cache)
+    print(f"Serving normalisation jobs on http://127.0.0.1:{port}/jobs, press Ctrl+C to stop...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopped serving.")
+    finally:
+        server.server_close()
+
+
+def main(args):
+    if args.profile != None and args.serve != None:
+        exit("--profile cannot be used with --serve, as jobs of the server run concurrently. Profile a single run instead.")
+    if args.profile != None:
+        PROFILER.enable(allocations=not args.profile_no_memory)
+
+    cache = ParseCache(directory=args.cache_dir, max_size=int(args.cache_size * 1024 * 1024)) if args.cache_dir != None else None
+
+    if args.serve != None:
+        serve(port=args.serve, cache=MemoryParseCache(max_size=int(args.cache_size * 1024 * 1024), backing=cache))
     else:
-        DAT.save_height_data_to_file(save_directory=dir_name, files=files)
-        DAT.save_kinetics_data_to_file(save_directory=dir_name)
+        if args.mode == None or args.ranges == None:
+            my_parser.error("the following arguments are required: -m/--mode, -r/--ranges")
+        normalise(args=args, manipulator=DAT, cache=cache)
+
+    if PROFILER.enabled:
+        print(f"\n\n{PROFILER.summary()}")
+        if args.profile != "":
+            PROFILER.save(path=args.profile)
+            print(f"\nSaved profile to: {args.profile}")
 
 
 
 
 if __name__ == "__main__":
+    ARGS = my_parser.parse_args()
+    print("\n\n")
     main(args=ARGS)
\ No newline at end of file
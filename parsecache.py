@@ -0,0 +1,211 @@
+import numpy as np
+from collections import OrderedDict
+import os, json, time, hashlib, threading
+
+
+class ParseCache():
+
+    ### Extracted data of each source file is kept as <content hash>.npz in the cache directory.
+    ### index.json maps a path (with its mtime and size) to a content hash, so unchanged files are never re-hashed.
+    def __init__(self, directory: str, max_size: int) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self.index_path = os.path.join(self.directory, "index.json")
+        os.makedirs(self.directory, exist_ok=True)
+        self.index = self.read_index()
+
+
+
+    def read_index(self) -> dict:
+        try:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+            if "files" in index and "entries" in index:
+                return index
+        except (OSError, ValueError):
+            pass
+
+        return {"files": {}, "entries": {}}
+
+
+    def write_index(self) -> None:
+        temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.index, f)
+        os.replace(temp_path, self.index_path)
+
+
+    def entry_path(self, content_hash: str) -> str:
+        return os.path.join(self.directory, f"{content_hash}.npz")
+
+
+    def content_hash(self, path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+
+    ### Returns the content hash of the file, re-hashing it only if its path, mtime or size are not in the index.
+    def file_key(self, path: str) -> str:
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        known = self.index["files"].get(key)
+
+        if known != None and known["mtime"] == stat.st_mtime_ns and known["size"] == stat.st_size:
+            return known["hash"]
+
+        content_hash = self.content_hash(path=path)
+        self.index["files"][key] = {"mtime": stat.st_mtime_ns, "size": stat.st_size, "hash": content_hash}
+        return content_hash
+
+
+
+
+
+##################################### Cache access:
+
+
+    def get(self, path: str) -> dict:
+        try:
+            content_hash = self.file_key(path=path)
+        except OSError:
+            return None
+
+        entry = self.index["entries"].get(content_hash)
+        if entry == None:
+            return None
+
+        try:
+            with np.load(self.entry_path(content_hash=content_hash), allow_pickle=False) as npz:
+                channels = json.loads(str(npz["channels"]))
+                time_data = npz["time"]
+                traces = npz["traces"]
+        except (OSError, ValueError, KeyError):
+            del self.index["entries"][content_hash]
+            self.write_index()
+            return None
+
+        entry["last_used"] = time.time()
+        self.write_index()
+
+        return {
+            "path": path,
+            "channels": channels,
+            "time": time_data,
+            "traces": traces,
+            "data_points": {str(channel["type"]): traces[i] for i, channel in enumerate(channels)},
+        }
+
+
+    def put(self, path: str, data: dict) -> None:
+        try:
+            content_hash = self.file_key(path=path)
+        except OSError:
+            return
+
+        entry_path = self.entry_path(content_hash=content_hash)
+        temp_path = f"{entry_path}.{os.getpid()}.tmp.npz"
+        np.savez(temp_path, time=data["time"], traces=data["traces"], channels=np.array(json.dumps(data["channels"])))
+        os.replace(temp_path, entry_path)
+
+        self.index["entries"][content_hash] = {"size": os.path.getsize(entry_path), "last_used": time.time()}
+        self.evict()
+        self.write_index()
+
+
+    ### Least recently used entries are removed until the cache fits in max_size bytes.
+    def evict(self) -> None:
+        entries = self.index["entries"]
+        total_size = sum(entry["size"] for entry in entries.values())
+
+        for content_hash in sorted(entries, key=lambda h: entries[h]["last_used"]):
+            if total_size <= self.max_size:
+                break
+
+            total_size -= entries[content_hash]["size"]
+            del entries[content_hash]
+            try:
+                os.remove(self.entry_path(content_hash=content_hash))
+            except OSError:
+                pass
+
+        self.index["files"] = {path: known for path, known in self.index["files"].items() if known["hash"] in entries}
+
+
+
+
+class MemoryParseCache():
+
+    ### In-memory LRU of extracted data keyed by absolute path, mtime and size, with the same get / put as ParseCache so it can be
+    ### passed wherever a cache is expected. Used by the server, where jobs run in parallel threads, so all access is locked.
+    ### Cached arrays are shared by all jobs and made read-only. An optional ParseCache behind it is used on misses.
+    def __init__(self, max_size: int, backing: ParseCache = None) -> None:
+        self.max_size = max_size
+        self.backing = backing
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+
+
+    def file_key(self, path: str) -> tuple:
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+    def get(self, path: str) -> dict:
+        try:
+            key = self.file_key(path=path)
+        except OSError:
+            return None
+
+        with self.lock:
+            data = self.entries.get(key)
+            if data != None:
+                self.entries.move_to_end(key)
+                return dict(data, path=path)
+
+            data = self.backing.get(path=path) if self.backing != None else None
+            if data != None:
+                self.add(key=key, data=data)
+
+        return data
+
+
+    def put(self, path: str, data: dict) -> None:
+        try:
+            key = self.file_key(path=path)
+        except OSError:
+            return
+
+        with self.lock:
+            if self.backing != None:
+                self.backing.put(path=path, data=data)
+            self.add(key=key, data=data)
+
+
+    ### Entries of older versions of the same file are replaced, then least recently used entries are removed above max_size bytes.
+    def add(self, key: tuple, data: dict) -> None:
+        for old_key in [old_key for old_key in self.entries if old_key[0] == key[0]]:
+            self.remove(key=old_key)
+
+        data["time"].flags.writeable = False
+        data["traces"].flags.writeable = False
+        for trace in data["data_points"].values():
+            trace.flags.writeable = False
+        self.entries[key] = data
+        self.size += data["time"].nbytes + data["traces"].nbytes
+
+        while self.size > self.max_size and len(self.entries) > 1:
+            self.remove(key=next(iter(self.entries)))
+
+
+    def remove(self, key: tuple) -> None:
+        data = self.entries.pop(key)
+        self.size -= data["time"].nbytes + data["traces"].nbytes
+
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -0,0 +1,103 @@
+import time, json, inspect, functools, tracemalloc
+
+
+class Profiler():
+
+    ### Records per stage: number of calls, cumulative wall time, points processed and the peak of memory allocated during the call.
+    ### While disabled, profiled functions only pay for a single attribute check.
+    ### Allocation tracking uses tracemalloc, which slows allocation-heavy stages (mostly reading) down noticeably, so it can be left off.
+    def __init__(self) -> None:
+        self.enabled = False
+        self.allocations = False
+        self.stages = {}
+        self.stack = []
+
+
+
+    def enable(self, allocations: bool = True) -> None:
+        self.enabled = True
+        self.allocations = allocations
+        self.stages = {}
+        self.stack = []
+        if self.allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+    def disable(self) -> None:
+        self.enabled = False
+        if self.allocations and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+    ### Nested stages (e.g. query_windows inside height_normalise) hand their peak up to the enclosing stage before the peak is reset.
+    def start_stage(self) -> dict:
+        current, peak = tracemalloc.get_traced_memory() if self.allocations else (0, 0)
+        if len(self.stack) > 0:
+            self.stack[-1]["peak"] = max(self.stack[-1]["peak"], peak)
+        if self.allocations:
+            tracemalloc.reset_peak()
+
+        frame = {"memory": current, "peak": current, "started": time.perf_counter()}
+        self.stack.append(frame)
+        return frame
+
+
+    def stop_stage(self, name: str, points: int, stopped: float) -> None:
+        peak = tracemalloc.get_traced_memory()[1] if self.allocations else 0
+        frame = self.stack.pop()
+        frame_peak = max(frame["peak"], peak)
+        if len(self.stack) > 0:
+            self.stack[-1]["peak"] = max(self.stack[-1]["peak"], frame_peak)
+
+        stage = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "points": 0, "allocated_mb": 0.0, "peak_allocated_mb": 0.0})
+        allocated = (frame_peak - frame["memory"]) / 1e6
+        stage["calls"] += 1
+        stage["seconds"] += stopped - frame["started"]
+        stage["points"] += points
+        stage["allocated_mb"] += allocated
+        stage["peak_allocated_mb"] = max(stage["peak_allocated_mb"], allocated)
+
+
+    def summary(self) -> str:
+        lines = [f"{'Stage':<28} {'Calls':>8} {'Time (s)':>12} {'Points':>14} {'Points/s':>14} {'Alloc (MB)':>12} {'Peak (MB)':>10}"]
+        for name, stage in self.stages.items():
+            rate = stage["points"] / stage["seconds"] if stage["seconds"] > 0 else 0
+            lines.append(f"{name:<28} {stage['calls']:>8} {stage['seconds']:>12.4f} {stage['points']:>14} {rate:>14.0f} {stage['allocated_mb']:>12.2f} {stage['peak_allocated_mb']:>10.2f}")
+        return "\n".join(lines)
+
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump({"stages": self.stages}, f, indent=2)
+
+
+PROFILER = Profiler()
+
+
+### Decorator of a profiled stage. points is called with the bound call arguments (by name) and the return value.
+def profiled(name: str, points=None):
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+
+            PROFILER.start_stage()
+            result = None
+            try:
+                result = func(*args, **kwargs)
+                return result
+            finally:
+                stopped = time.perf_counter()
+                count = 0
+                if points != None:
+                    try:
+                        count = int(points(signature.bind(*args, **kwargs).arguments, result))
+                    except Exception:
+                        count = 0
+                PROFILER.stop_stage(name=name, points=count, stopped=stopped)
+
+        return wrapper
+    return decorator
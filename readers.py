@@ -0,0 +1,263 @@
+from openpyxl import Workbook, load_workbook
+import numpy as np
+import io, os, re, csv
+
+
+class XLSXFileError(Exception):
+    pass
+
+
+### A channel is selected by its detector type (case-insensitive) or by its channel ID, no selection keeps every channel.
+def is_channel_selected(channel: dict, channels: list) -> bool:
+    if channels == None:
+        return True
+
+    selection = [str(name).strip().lower() for name in channels]
+    return str(channel["type"]).strip().lower() in selection or str(channel["id"]).strip().lower() in selection
+
+
+### Indexes of the selected channels of a file, a file without any (selected) channel cannot be normalised.
+def select_columns(path: str, all_channels: list, channels: list) -> list:
+    selected = [i for i, channel in enumerate(all_channels) if is_channel_selected(channel=channel, channels=channels)]
+    if len(selected) == 0 and channels == None:
+        raise XLSXFileError(f"File at path:\n\n{path}\n\nhas no channels, its \"Channel ID\" block is missing or empty!")
+    if len(selected) == 0:
+        raise XLSXFileError(f"File at path:\n\n{path}\n\nhas none of the selected channels: {', '.join(str(name) for name in channels)}")
+    return selected
+
+
+
+
+class Reader():
+
+    ### Base of the source file readers. A reader turns a file with the instrument's "Channel ID" / "RT (mins)" layout into the
+    ### data dict used by XLSXFile and DataManipulator, keeping only the selected channels.
+    extensions = ()
+
+    ### True if the first bytes of a file with an unknown extension look like this reader's format.
+    def sniff(self, head: bytes) -> bool:
+        return False
+
+
+    def read(self, path: str, channels: list = None) -> dict:
+        raise NotImplementedError
+
+
+    def make_data(self, path: str, channels: list, time: np.ndarray, traces: np.ndarray) -> dict:
+        result = {
+            "path": path,
+            "channels": channels,
+        }
+        result["time"], result["traces"] = self.sort_on_time(time=time, traces=traces)
+        result["data_points"] = {str(channel["type"]): result["traces"][i] for i, channel in enumerate(channels)}
+        print(f"Successful data extraction from: {os.path.basename(path)}")
+        return result
+
+
+    ### Time axis is kept sorted (stable, so duplicate retention times keep their order) so windows can be found by binary search.
+    def sort_on_time(self, time: np.ndarray, traces: np.ndarray) -> tuple:
+        if np.all(time[1:] >= time[:-1]):
+            return (time, traces)
+
+        order = np.argsort(time, kind="stable")
+        return (time[order], np.ascontiguousarray(traces[:, order]))
+
+
+
+
+class XLSXReader(Reader):
+
+    extensions = (".xlsx", ".xlsm")
+
+    def sniff(self, head: bytes) -> bool:
+        return head.startswith(b"PK\x03\x04")
+
+
+    ### Workbook is opened in read-only mode so the sheets are streamed from the archive rather than loaded as a whole.
+    def read(self, path: str, channels: list = None) -> dict:
+        wb = self.make_workbook(path=path)
+        try:
+            return self.read_workbook(wb=wb, path=path, channels=channels)
+        finally:
+            wb.close()
+
+
+    def make_workbook(self, path: str) -> Workbook:
+        try:
+            wb = load_workbook(filename=path, read_only=True, data_only=True)
+            return wb
+        except Exception:
+            raise XLSXFileError(f"File at path:\n\n{path}\n\ncould not have been read! Please make sure to select only .xlsx files!")
+
+
+    ### Single pass over the "Raw Data" sheet: the "Channel ID" block is read first, then the "RT (mins)" block with all traces row by row.
+    ### openpyxl still tokenises every cell, but only the time axis and the selected columns are converted and kept.
+    def read_workbook(self, wb: Workbook, path: str, channels: list = None) -> dict:
+        if "Raw Data" not in wb.sheetnames:
+            raise XLSXFileError(f"File at path:\n\n{path}\n\nhas no \"Raw Data\" sheet!")
+
+        sh = wb["Raw Data"]
+
+        time = []
+        all_channels = []
+        selected = []
+        rows = []
+        block = None
+
+        for values in sh.iter_rows(values_only=True):
+            value = values[0] if len(values) > 0 else None
+
+            if block == "channels":
+                if value == None:
+                    block = None
+                    continue
+
+                channel = {
+                    "id": value,
+                    "type": values[1] if len(values) > 1 else None
+                }
+
+                all_channels.append(channel)
+                continue
+
+            if block == "traces":
+                if value == None:
+                    break
+
+                time.append(value)
+                rows.append([values[column] if len(values) > column else None for column in selected])
+                continue
+
+            if value == "Channel ID":
+                block = "channels"
+            elif value == "RT (mins)":
+                block = "traces"
+                selected = [i + 1 for i in select_columns(path=path, all_channels=all_channels, channels=channels)]
+
+        channels = [all_channels[column - 1] for column in selected]
+        return self.make_data(path=path, channels=channels, time=np.array(time, dtype=np.float64), traces=self.make_traces_array(rows=rows, number_of_channels=len(channels)))
+
+
+    ### A trace ends at its first empty cell, the rest of its column is NaN.
+    def make_traces_array(self, rows: list, number_of_channels: int) -> np.ndarray:
+        traces = np.full((number_of_channels, len(rows)), np.nan, dtype=np.float64)
+
+        for channel in range(0, number_of_channels):
+            column = [row[channel] if len(row) > channel else None for row in rows]
+            length = column.index(None) if None in column else len(column)
+            traces[channel, :length] = column[:length]
+
+        return traces
+
+
+
+
+class TextReader(Reader):
+
+    ### Delimited text exports (comma, semicolon or tab) with the same layout as the "Raw Data" sheet. The header blocks are split
+    ### line by line, the "RT (mins)" block is converted in one np.loadtxt call reading only the time and selected columns.
+    extensions = (".csv", ".txt", ".tsv")
+    delimiters = ("\t", ";", ",")
+
+    def sniff(self, head: bytes) -> bool:
+        text = head.decode("utf-8", errors="ignore")
+        return "Channel ID" in text or "RT (mins)" in text
+
+
+    def read(self, path: str, channels: list = None) -> dict:
+        try:
+            with open(path, "r", encoding="utf-8-sig", errors="replace", newline=None) as f:
+                lines = f.read().split("\n")
+        except OSError:
+            raise XLSXFileError(f"File at path:\n\n{path}\n\ncould not have been read!")
+
+        header = next((i for i, line in enumerate(lines) if self.first_field(line=line) == "RT (mins)"), None)
+        if header == None:
+            raise XLSXFileError(f"File at path:\n\n{path}\n\nhas no \"RT (mins)\" block!")
+
+        delimiter = next((d for d in self.delimiters if d in lines[header]), ",")
+        all_channels = self.read_channels(lines=lines[:header], delimiter=delimiter)
+        selected = select_columns(path=path, all_channels=all_channels, channels=channels)
+
+        stop = header + 1
+        while stop < len(lines) and lines[stop].split(delimiter, 1)[0].strip() != "":
+            stop += 1
+
+        table = self.read_table(path=path, lines=lines[header + 1 : stop], delimiter=delimiter, columns=[0] + [i + 1 for i in selected])
+        traces = np.ascontiguousarray(table[:, 1:].T)
+        traces[np.cumsum(np.isnan(traces), axis=1) > 0] = np.nan
+        return self.make_data(path=path, channels=[all_channels[i] for i in selected], time=np.ascontiguousarray(table[:, 0]), traces=traces)
+
+
+    def first_field(self, line: str) -> str:
+        return re.split(r"[\t;,]", line, maxsplit=1)[0].strip().strip('"')
+
+
+    ### Channel IDs that are whole numbers become ints, as they are read from a workbook. Quoted fields may contain the delimiter.
+    def read_channels(self, lines: list, delimiter: str) -> list:
+        channels = []
+        block = False
+
+        for values in csv.reader(lines, delimiter=delimiter):
+            values = [value.strip() for value in values] or [""]
+            if block:
+                if values[0] == "":
+                    break
+                channels.append({
+                    "id": int(values[0]) if values[0].isdigit() else values[0],
+                    "type": values[1] if len(values) > 1 and values[1] != "" else None,
+                })
+            elif values[0] == "Channel ID":
+                block = True
+
+        return channels
+
+
+    ### Empty fields become NaN. Rows missing trailing fields are padded with NaN, which needs a slower line by line pass.
+    def read_table(self, path: str, lines: list, delimiter: str, columns: list) -> np.ndarray:
+        if len(lines) == 0:
+            return np.empty((0, len(columns)), dtype=np.float64)
+
+        escaped = re.escape(delimiter)
+        text = re.sub(f"(?m)(?<={escaped})(?=[ ]*(?:{escaped}|$))", "nan", "\n".join(lines))
+
+        try:
+            return np.loadtxt(io.StringIO(text), delimiter=delimiter, usecols=columns, ndmin=2, dtype=np.float64)
+        except ValueError:
+            pass
+
+        try:
+            rows = [line.split(delimiter) for line in text.split("\n")]
+            return np.array([[float(row[c]) if c < len(row) else np.nan for c in columns] for row in rows], dtype=np.float64)
+        except ValueError:
+            raise XLSXFileError(f"File at path:\n\n{path}\n\nhas values in its \"RT (mins)\" block that are not numbers!")
+
+
+
+
+READERS = [XLSXReader(), TextReader()]
+EXTENSIONS = tuple(extension for reader in READERS for extension in reader.extensions)
+
+
+### The reader is picked by the file extension, files with other extensions by sniffing their first bytes.
+def get_reader(path: str) -> Reader:
+    extension = os.path.splitext(path)[1].lower()
+    for reader in READERS:
+        if extension in reader.extensions:
+            return reader
+
+    try:
+        with open(path, "rb") as f:
+            head = f.read(1 << 16)
+    except OSError:
+        raise XLSXFileError(f"File at path:\n\n{path}\n\ncould not have been read!")
+
+    for reader in READERS:
+        if reader.sniff(head=head):
+            return reader
+
+    raise XLSXFileError(f"File at path:\n\n{path}\n\nis not in a supported format! Please select {', '.join(EXTENSIONS)} files.")
+
+
+def is_supported_file(name: str) -> bool:
+    return name.lower().endswith(EXTENSIONS) and not name.startswith("~$")
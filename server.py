@@ -0,0 +1,102 @@
+from parsecache import MemoryParseCache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import json, time, threading
+
+
+class NormalisationServer(ThreadingHTTPServer):
+
+    ### Local HTTP server keeping the tool resident between jobs. Every request runs in its own thread, so jobs run concurrently,
+    ### each with its own DataManipulator and exporter made by run_job. Only the parse cache is shared, so files read by one job
+    ### are not parsed again by the next one while they are unchanged.
+    daemon_threads = True
+
+    def __init__(self, address: tuple, run_job, cache: MemoryParseCache) -> None:
+        super().__init__(address, JobHandler)
+        self.run_job = run_job
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.running = {}
+        self.finished = 0
+        self.failed = 0
+
+
+
+    ### The checks of the tool end a job with exit(message), which is reported back to the client instead of stopping the server.
+    def run(self, job: dict) -> tuple:
+        with self.lock:
+            job_id = self.next_id
+            self.next_id += 1
+            self.running[job_id] = time.time()
+
+        started = time.perf_counter()
+        try:
+            status, body = 200, self.run_job(job)
+        except SystemExit as error:
+            message = error.code if isinstance(error.code, str) else "The job arguments could not have been parsed, see the server output."
+            status, body = 400, {"error": message}
+        except Exception as error:
+            status, body = 500, {"error": f"{type(error).__name__}: {error}"}
+
+        with self.lock:
+            del self.running[job_id]
+            if status == 200:
+                self.finished += 1
+            else:
+                self.failed += 1
+
+        body["id"] = job_id
+        body["seconds"] = round(time.perf_counter() - started, 3)
+        print(f"Job {job_id} {'finished' if status == 200 else 'failed'} in {body['seconds']} s.")
+        return (status, body)
+
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                "running": len(self.running),
+                "finished": self.finished,
+                "failed": self.failed,
+                "cached_files": len(self.cache),
+                "cached_mb": round(self.cache.size / 1e6, 3),
+            }
+
+
+
+
+class JobHandler(BaseHTTPRequestHandler):
+
+    ### POST /jobs with a JSON object of job options answers with the job summary once it has finished.
+    ### GET /status reports the number of running and completed jobs and the size of the parse cache.
+    def do_POST(self) -> None:
+        if self.path != "/jobs":
+            self.send_json(status=404, body={"error": f"Unknown path: {self.path}"})
+            return
+
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            if not isinstance(job, dict):
+                raise ValueError("a job has to be a JSON object")
+        except ValueError as error:
+            self.send_json(status=400, body={"error": f"Could not read the job: {error}"})
+            return
+
+        status, body = self.server.run(job=job)
+        self.send_json(status=status, body=body)
+
+
+    def do_GET(self) -> None:
+        if self.path != "/status":
+            self.send_json(status=404, body={"error": f"Unknown path: {self.path}"})
+            return
+
+        self.send_json(status=200, body=self.server.status())
+
+
+    def send_json(self, status: int, body: dict) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
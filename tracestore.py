@@ -0,0 +1,86 @@
+import numpy as np
+import os, json
+
+
+class TraceStore():
+
+    ### On-disk store of the float64 arrays of a run. Every array is appended to a single data file that is memory mapped, so
+    ### the rest of the tool works on zero-copy views of it and only the pages in use are kept in RAM by the OS.
+    ### The index maps a (file, channel, range, kind) key to the offset and shape of its array and is written to index.json.
+    ### The data file is emptied whenever a store is opened on the directory.
+    def __init__(self, directory: str, capacity: int = 1 << 20) -> None:
+        self.directory = directory
+        self.data_path = os.path.join(directory, "traces.bin")
+        self.index_path = os.path.join(directory, "index.json")
+        self.index = {}
+        self.size = 0
+        self.capacity = 0
+        self.map = None
+
+        os.makedirs(directory, exist_ok=True)
+        with open(self.data_path, "wb"):
+            pass
+        self.grow(capacity=capacity)
+
+
+
+    ### The data file doubles when full. Views of the previous mapping stay valid, both map the same pages of the file.
+    def grow(self, capacity: int) -> None:
+        if self.map is not None:
+            self.map.flush()
+
+        with open(self.data_path, "r+b") as f:
+            f.truncate(capacity * 8)
+
+        self.capacity = capacity
+        self.map = np.memmap(self.data_path, dtype=np.float64, mode="r+", shape=(capacity,))
+
+
+    def make_key(self, file_name: str, channel: str, range_key: str, kind: str) -> str:
+        return f"{file_name}|{channel}|{range_key}|{kind}"
+
+
+    ### Writable view of a new array, a key that is stored again points to the new array.
+    def allocate(self, key: str, shape: tuple) -> np.ndarray:
+        length = int(np.prod(shape))
+        if self.size + length > self.capacity:
+            self.grow(capacity=max(2 * self.capacity, self.size + length))
+
+        view = self.map[self.size : self.size + length].reshape(shape)
+        self.index[key] = {"offset": self.size, "shape": list(shape)}
+        self.size += length
+        return view
+
+
+    def put(self, key: str, array: np.ndarray) -> np.ndarray:
+        view = self.allocate(key=key, shape=np.shape(array))
+        view[...] = array
+        return view
+
+
+    def get(self, key: str) -> np.ndarray:
+        entry = self.index.get(key)
+        if entry == None:
+            return None
+
+        length = int(np.prod(entry["shape"]))
+        return self.map[entry["offset"] : entry["offset"] + length].reshape(entry["shape"])
+
+
+    ### Moves the time axis and traces of a parsed file into the store, the returned data dict only holds views of it.
+    def add_data(self, data: dict) -> dict:
+        file_name = os.path.basename(data["path"])
+        output = dict(data)
+        output["time"] = self.put(key=self.make_key(file_name=file_name, channel=None, range_key=None, kind="time"), array=data["time"])
+        output["traces"] = self.put(key=self.make_key(file_name=file_name, channel=None, range_key=None, kind="traces"), array=data["traces"])
+        output["data_points"] = {str(channel["type"]): output["traces"][i] for i, channel in enumerate(data["channels"])}
+        return output
+
+
+    ### The unused capacity at the end of the data file is cut off, views into the stored arrays stay valid.
+    def close(self) -> None:
+        self.map.flush()
+        with open(self.data_path, "r+b") as f:
+            f.truncate(self.size * 8)
+        with open(self.index_path, "w") as f:
+            json.dump({"dtype": "float64", "size": self.size, "entries": self.index}, f)
@@ -0,0 +1,140 @@
+from xlsxfile import XLSXFile, read_xlsx_data
+from readers import is_supported_file
+from exporters import Exporter
+from datamanipulator import DataManipulator
+from concurrent.futures import ProcessPoolExecutor
+import os, time, asyncio
+
+
+class DirectoryWatcher():
+
+    ### Watches a directory the instrument exports into and normalises every new supported file once it has been fully written.
+    ### A file counts as written when its size and modification time are unchanged over two polls at least settle seconds apart.
+    ### Ready files are parsed in a process pool, each file is normalised once and added to the running kinetic normalisation,
+    ### then the result files are rewritten. Files that land together are handled as one update.
+    def __init__(self, directory: str, mode: str, ranges: list, save_directory: str, manipulator: DataManipulator, exporter: Exporter, jobs: int = 1, interval: float = 2.0, settle: float = 2.0, channels: list = None, state: str = None) -> None:
+        self.directory = directory
+        self.mode = mode
+        self.ranges = ranges
+        self.save_directory = save_directory
+        self.manipulator = manipulator
+        self.exporter = exporter
+        self.jobs = jobs
+        self.interval = interval
+        self.settle = settle
+        self.channels = channels
+        self.state = state
+        self.files = []
+        self.processed = set()
+        self.pending = {}
+        self.failed = {}
+
+
+
+    ### Files already in a loaded kinetic state are not normalised again.
+    def skip_files(self, file_names: list) -> None:
+        self.processed.update(file_names)
+
+
+    def run(self) -> None:
+        asyncio.run(self.watch())
+
+
+    async def watch(self) -> None:
+        print(f"Watching {self.directory} for new files, press Ctrl+C to stop...")
+        loop = asyncio.get_running_loop()
+
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            while True:
+                paths = self.find_ready_paths()
+                if len(paths) > 0:
+                    files = await self.read_files(loop=loop, executor=executor, paths=paths)
+                    if len(files) > 0:
+                        await loop.run_in_executor(None, self.update, files)
+                await asyncio.sleep(self.interval)
+
+
+
+
+
+##################################### Debouncing:
+
+
+    ### Excel lock files are skipped. A file that could not be read is only tried again once it has changed on disk.
+    def find_ready_paths(self) -> list:
+        now = time.monotonic()
+        ready = []
+
+        try:
+            entries = sorted(os.scandir(self.directory), key=lambda entry: entry.name)
+        except OSError as error:
+            print(f"Could not list {self.directory}:\n{error}")
+            return ready
+
+        for entry in entries:
+            if not is_supported_file(name=entry.name) or entry.name in self.processed:
+                continue
+
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if stat.st_size == 0 or self.failed.get(entry.path) == signature:
+                continue
+
+            seen = self.pending.get(entry.path)
+            if seen == None or seen[0] != signature:
+                self.pending[entry.path] = (signature, now)
+            elif now - seen[1] >= self.settle:
+                ready.append(entry.path)
+
+        return ready
+
+
+    async def read_files(self, loop, executor: ProcessPoolExecutor, paths: list) -> list:
+        futures = [loop.run_in_executor(executor, read_xlsx_data, path, self.channels) for path in paths]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        files = []
+
+        for path, result in zip(paths, results):
+            signature = self.pending.pop(path)[0]
+            if isinstance(result, Exception):
+                self.failed[path] = signature
+                print(f"Skipping {os.path.basename(path)} until it changes:\n{result}")
+                continue
+
+            self.failed.pop(path, None)
+            self.processed.add(os.path.basename(path))
+            files.append(XLSXFile(path=path, data=result))
+
+        return files
+
+
+
+
+
+##################################### Results:
+
+
+    ### Only the new files are normalised, earlier files keep their height results and their kinetic windows in the accumulator.
+    ### Kinetic results are rescaled on every update, as a new file can change the largest height / area ratio of a channel.
+    def update(self, files: list) -> None:
+        started = time.perf_counter()
+
+        for file in files:
+            self.manipulator.normalise_file(file=file, ranges=self.ranges, mode=self.mode)
+            self.files.append(file)
+
+        if self.mode != "kinetic":
+            self.exporter.save_height(save_directory=self.save_directory, files=self.files)
+        if self.mode != "height":
+            self.manipulator.number_of_files = len(self.manipulator.kinetics.file_names())
+            self.manipulator.finish_kinetics()
+            self.exporter.save_kinetics(save_directory=self.save_directory)
+        if self.state != None:
+            self.manipulator.save_kinetics_state(path=self.state)
+
+        names = ", ".join(os.path.basename(file.path) for file in files)
+        print(f"Normalised {names} in {time.perf_counter() - started:.2f} s ({len(self.processed)} file(s) so far).\n")
@@ -0,0 +1,56 @@
+import numpy as np
+
+
+class WindowIndex():
+
+    ### Index over the (channels x points) traces of one file answering window queries in O(1) per window:
+    ### sparse tables give the min and max of any index range, a cumulative trapezoidal integral gives its area.
+    ### Built per file only when it has many ranges (O(N log N) memory per channel) and dropped once they are queried.
+    def __init__(self, time: np.ndarray, traces: np.ndarray) -> None:
+        self.time = time
+        self.traces = traces
+        self.min_tables = self.make_sparse_tables(reduce=np.minimum)
+        self.max_tables = self.make_sparse_tables(reduce=np.maximum)
+        self.cumulative = np.zeros(traces.shape, dtype=np.float64)
+        np.cumsum((traces[:, 1:] + traces[:, :-1]) * np.diff(time) * 0.5, axis=1, out=self.cumulative[:, 1:])
+
+
+
+    ### Level k of a table holds the reduction of every run of 2**k points starting at each index.
+    def make_sparse_tables(self, reduce) -> list:
+        tables = [self.traces]
+        span = 1
+
+        while 2 * span <= self.traces.shape[1]:
+            previous = tables[-1]
+            tables.append(reduce(previous[:, :-span], previous[:, span:]))
+            span *= 2
+
+        return tables
+
+
+    def query(self, tables: list, reduce, starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+        lengths = stops - starts + 1
+        levels = np.floor(np.log2(lengths)).astype(np.int64)
+        result = np.empty((self.traces.shape[0], len(starts)), dtype=np.float64)
+
+        for level in np.unique(levels):
+            windows = np.nonzero(levels == level)[0]
+            table = tables[level]
+            result[:, windows] = reduce(table[:, starts[windows]], table[:, stops[windows] - (1 << level) + 1])
+
+        return result
+
+
+    ### (channels x windows) arrays of window minima and maxima.
+    def minima(self, starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+        return self.query(tables=self.min_tables, reduce=np.minimum, starts=starts, stops=stops)
+
+
+    def maxima(self, starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+        return self.query(tables=self.max_tables, reduce=np.maximum, starts=starts, stops=stops)
+
+
+    ### (channels x windows) trapezoidal areas of the windows after shifting each by its own minimum.
+    def shifted_areas(self, starts: np.ndarray, stops: np.ndarray, mins: np.ndarray) -> np.ndarray:
+        return self.cumulative[:, stops] - self.cumulative[:, starts] - mins * (self.time[stops] - self.time[starts])
@@ -1,107 +1,58 @@
-from openpyxl import Workbook, load_workbook
+from readers import select_columns, get_reader
+from parsecache import ParseCache
+from tracestore import TraceStore
+from profiler import profiled
+import numpy as np
 import os, uuid
 
 
-class XLSXFile():
-
-    def __init__(self, path: str) -> None:
-        self.id = uuid.uuid4()
-        self.path = path
-        self.results = []
-        self.wb = self.make_workbook(path=self.path)
-        self.data = self.read_workbook(wb=self.wb)
-        
-    
-
-    def make_workbook(self, path: str) -> Workbook:
-        try:
-            wb = load_workbook(filename=path)
-            return wb
-        except:
-            print(f"File at path:\n\n{path}\n\ncould not have been read! Please make sure to select only .xlsx files!")
-            exit()
-
-
-    def read_workbook(self, wb: Workbook) -> dict:
-        result = {
-            "path": self.path
-        }
-
-        sh = wb["Raw Data"]
-
-        column = 1
-        row = 1
-        catchRow = 0
-        max_index = 5000
-
-        time = []
-        channels = []
-        data_points = {}
-
-        while True:
-            value = sh.cell(column=column, row=row).value
+### Entry point for worker processes: only the extracted data dict is sent back, never the openpyxl Workbook.
+def read_xlsx_data(path: str, channels: list = None) -> dict:
+    return XLSXFile(path=path, channels=channels).data
 
-            if value == "Channel ID":
-                catchRow = row
-                while True:
-                    row += 1
-                    val = sh.cell(column=column, row=row).value
 
-                    if val == None:
-                        row = catchRow
-                        break
+### Returns data restricted to the selected channels, the traces array is copied so the rest of the channels can be freed.
+def select_channels(data: dict, channels: list) -> dict:
+    if channels == None:
+        return data
 
-                    channel = {
-                        "id": sh.cell(column=column, row=row).value,
-                        "type": sh.cell(column=column+1, row=row).value
-                    }
+    selected = select_columns(path=data["path"], all_channels=data["channels"], channels=channels)
 
-                    channels.append(channel)
+    output = dict(data)
+    output["channels"] = [data["channels"][i] for i in selected]
+    output["traces"] = np.ascontiguousarray(data["traces"][selected])
+    output["data_points"] = {str(channel["type"]): output["traces"][i] for i, channel in enumerate(output["channels"])}
+    return output
 
-            if value == "RT (mins)":
-                catchRow = row
 
-                while True: # Time extraction...
-                    row += 1
-                    val = sh.cell(column=column, row=row).value
-
-                    if val == None:
-                        max_index = row
-                        row = catchRow
-                        break
-
-                    time.append(float(val))
-
-                i = 1
-                
-                for channel in channels:
-                    i += 1
-                    data = []
-
-                    while True: # Traces extraction
-                        row += 1
-                        val = sh.cell(column=i, row=row).value
-
-                        if val == None:
-                            row = catchRow
-                            break
-
-                        data.append(float(val))
-
-                    key = str(channel["type"])
-                    data_points[key] = data
-
-            
-            row += 1
+### Compact record of one source file: only the extracted data and the results are kept. Despite the name, any format with a
+### reader in readers.py (.xlsx workbooks, delimited text exports) is accepted, the reader is picked from the path.
+class XLSXFile():
 
-            if row > max_index:
-                break
+    __slots__ = ("id", "path", "results", "data")
 
+    ### data can be passed in when the file has already been parsed elsewhere (e.g. in a worker process).
+    ### With a cache, a valid cached copy of the data is used instead of parsing, and a freshly parsed file is stored in it.
+    ### With channels, only the time axis and the selected detector columns are decoded and kept. The cache only ever holds
+    ### complete files, so a file read with a channel selection is not stored in it.
+    ### With a trace store, the time axis and traces are moved into it and the file only keeps views of them.
+    @profiled("XLSXFile", points=lambda call, result: call["self"].data["traces"].size)
+    def __init__(self, path: str, data: dict = None, cache: ParseCache = None, channels: list = None, store: TraceStore = None) -> None:
+        self.id = uuid.uuid4()
+        self.path = path
+        self.results = []
 
-        result["time"] = time
-        result["channels"] = channels
-        result["data_points"] = data_points
-        print(f"Successful data extraction from: {os.path.basename(self.path)}")
-        return result
+        if data == None and cache != None:
+            data = cache.get(path=self.path)
+            if data != None:
+                print(f"Loaded cached data of: {os.path.basename(self.path)}")
 
+        if data == None:
+            self.data = get_reader(path=self.path).read(path=self.path, channels=channels)
+            if cache != None and channels == None:
+                cache.put(path=self.path, data=self.data)
+        else:
+            self.data = select_channels(data=data, channels=channels)
 
+        if store != None:
+            self.data = store.add_data(data=self.data)